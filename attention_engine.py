@@ -0,0 +1,994 @@
+import math
+import time
+import queue
+import threading
+import asyncio
+import cv2
+import numpy as np
+from helpers import get_index_array, get_landmark_array, get_ratio_array, get_attention_score_array
+from threshold_store import ThresholdStore
+from concurrent.futures import ThreadPoolExecutor
+from frame_sources import CaptureSettings, open_source, yields_landmarks
+from pipeline import InferencePool
+from flight_recorder import FlightRecorder
+from metrics import Metrics, NULL_METRICS
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+####### SAMPLING SCHEDULER #####################################################################################################################################################
+
+class AdaptiveScheduler:
+    """
+    Decides which camera frames go through FaceMesh.
+    While the attention state is settling, a sample is taken every fast_interval (the decision cadence).
+    Once the decider reports the state as settled, sampling drops to every idle_interval.
+    Frames in between are only grabbed, to keep the camera buffer fresh, and never decoded or processed.
+    """
+    def __init__(self, fast_interval: float, idle_interval: float):
+        self.fast_interval = fast_interval
+        self.idle_interval = max(idle_interval, fast_interval)
+        self.next_sample_time = 0.0
+
+    def due(self, now: float, next_sample_time: Optional[float] = None) -> bool:
+        # A few milliseconds of slack so frame timing jitter does not push a sample to the next frame
+        return now >= (self.next_sample_time if next_sample_time is None else next_sample_time) - 0.005
+
+    def schedule(self, now: float, stable: bool):
+        self.next_sample_time = now + (self.idle_interval if stable else self.fast_interval)
+
+    def reachable(self, pending: List[float]) -> List[float]:
+        """
+        Every next sample time the scheduler can still end up with once the samples taken at pending (oldest
+        first, after the last one it was scheduled from) are decided. Each of them may settle the state or not,
+        so it opens both intervals; one that is not due under any earlier branch can never be taken.
+        Assumes finite scores, which real landmarks always give; AttentionDecider.update skips the others.
+        """
+        times = [self.next_sample_time]
+        for now in pending:
+            taken = [candidate for candidate in times if self.due(now, candidate)]
+            if taken:
+                times = [candidate for candidate in times if candidate not in taken] + [now + self.fast_interval, now + self.idle_interval]
+        return times
+
+####### FACE REGION OF INTEREST ###############################################################################################################################################
+
+class FaceRegion:
+    """
+    Tracks the face bounding box between samples so FaceMesh can run on a small crop instead of the full frame.
+    The crop is a square around the previous landmarks (margin times their extent), clipped to the frame and
+    downscaled so its longer side is at most roi_size pixels. Colour conversion only touches the crop.
+    Without a previous face the full frame is used as is.
+    """
+    def __init__(self, roi_size: int = 256, margin: float = 1.6):
+        self.roi_size = roi_size
+        self.margin = margin
+        self.box = None  # (x0, y0, x1, y1) in full frame pixels, None means full frame
+        self.crop_box = None
+        self.frame_size = None
+
+    def crop(self, frame: np.ndarray) -> np.ndarray:
+        """Return the RGB image to run FaceMesh on"""
+        h, w = frame.shape[:2]
+        self.frame_size = (w, h)
+        if self.box is None:
+            self.crop_box = (0, 0, w, h)
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+        x0, y0, x1, y1 = self.crop_box = self.box
+        region = frame[y0:y1, x0:x1]
+        scale = self.roi_size / max(x1 - x0, y1 - y0)
+        if scale < 1:
+            size = (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale)))
+            region = cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(region, cv2.COLOR_BGR2RGB)
+
+    def to_frame(self, landmark_array: np.ndarray) -> np.ndarray:
+        """Map normalized landmarks of the last crop back into normalized full frame coordinates"""
+        x0, y0, x1, y1 = self.crop_box
+        w, h = self.frame_size
+        scale = np.array([(x1 - x0) / w, (y1 - y0) / h], dtype=np.float32)
+        offset = np.array([x0 / w, y0 / h], dtype=np.float32)
+        return landmark_array * scale + offset
+
+    def update(self, landmark_array: np.ndarray):
+        """Centre the next crop on full frame landmarks"""
+        w, h = self.frame_size
+        pixels = landmark_array * np.array([w, h], dtype=np.float32)
+        low = pixels.min(axis=0)
+        high = pixels.max(axis=0)
+        cx, cy = (low + high) / 2
+        half = float((high - low).max()) * self.margin / 2
+        x0, y0 = max(0, int(cx - half)), max(0, int(cy - half))
+        x1, y1 = min(w, int(cx + half) + 1), min(h, int(cy + half) + 1)
+        self.box = (x0, y0, x1, y1) if x1 - x0 > 1 and y1 - y0 > 1 else None
+
+    def reset(self):
+        self.box = None
+
+####### LANDMARK TRACKING ######################################################################################################################################################
+
+class LandmarkTracker:
+    """
+    Follows the landmarks from one sampled frame to the next with pyramidal Lucas-Kanade optical flow,
+    so FaceMesh only has to run on keyframes. Flow is computed on a grayscale window around the face
+    (margin times the landmark extent), placed when the track starts. A point counts as lost when tracking it forward and back again
+    misses its start by more than max_error pixels, and then the whole track is dropped.
+    """
+    def __init__(self, max_error: float = 1.0, window: int = 15, levels: int = 2, margin: float = 1.6):
+        self.max_error = max_error
+        self.flow_params = dict(winSize=(window, window), maxLevel=levels,
+                                criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self.region = FaceRegion(margin=margin)
+        self.previous = None  # Grayscale face window of the last frame
+        self.points = None  # (13, 1, 2) float32 landmark pixels in that window
+
+    def reset(self):
+        self.previous = None
+        self.points = None
+
+    def _window(self, frame: np.ndarray) -> np.ndarray:
+        x0, y0, x1, y1 = self.region.box
+        return cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+
+    def start(self, frame: np.ndarray, landmark_array: np.ndarray):
+        """Begin a new track from FaceMesh landmarks (normalized, full frame) of this frame"""
+        h, w = frame.shape[:2]
+        self.region.frame_size = (w, h)
+        self.region.update(landmark_array)
+        if self.region.box is None:
+            self.reset()
+            return
+        x0, y0 = self.region.box[:2]
+        self.previous = self._window(frame)
+        self.points = (landmark_array * np.array([w, h], dtype=np.float32) - np.array([x0, y0], dtype=np.float32)).reshape(-1, 1, 2)
+
+    def track(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """Landmarks moved into this frame, or None if the track was lost"""
+        if self.previous is None:
+            return None
+        current = self._window(frame)
+        if current.shape != self.previous.shape:
+            self.reset()
+            return None
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self.previous, current, self.points, None, **self.flow_params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(current, self.previous, points, None, **self.flow_params)
+        error = np.abs(back - self.points).reshape(-1, 2).max(axis=1)
+        if not (status.all() and back_status.all() and error.max() <= self.max_error):
+            self.reset()
+            return None
+
+        h, w = frame.shape[:2]
+        x0, y0 = self.region.box[:2]
+        self.previous = current
+        self.points = points
+        return (points.reshape(-1, 2) + np.array([x0, y0], dtype=np.float32)) / np.array([w, h], dtype=np.float32)
+
+####### FACE PRESENCE GATE #####################################################################################################################################################
+
+class PresenceGate:
+    """
+    Cheap check in front of FaceMesh while nobody is in view. Once FaceMesh found no face min_absent times in a
+    row, every later frame is compared with the last empty one at thumbnail size. While the scene stays still
+    it is still empty and FaceMesh is skipped. When something moved, MediaPipe face detection on a small copy
+    of the frame (if face_detection is given) decides whether FaceMesh has to run, otherwise it always runs.
+    FaceMesh also runs after recheck_interval skipped samples, in case a face arrived without any motion.
+    The gate never delays the pause for a face that leaves, it only acts once FaceMesh already found none.
+    """
+    def __init__(self, face_detection=None, size: Tuple[int, int] = (80, 60), motion_threshold: float = 3.0,
+                 detection_width: int = 256, min_absent: int = 3, recheck_interval: int = 10):
+        self.face_detection = face_detection
+        self.size = size
+        self.motion_threshold = motion_threshold  # Mean absolute grey level difference that counts as motion
+        self.detection_width = detection_width
+        self.min_absent = min_absent
+        self.recheck_interval = recheck_interval
+        self.reference = None  # Thumbnail of the last frame known to be empty
+        self.absent = 0  # FaceMesh runs in a row without a face
+        self.skipped = 0  # Samples skipped since FaceMesh last ran
+
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        return cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+    def _face_detected(self, frame: np.ndarray) -> bool:
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.detection_width / w)
+        small = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        return bool(self.face_detection.process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB)).detections)
+
+    def skip(self, frame: np.ndarray) -> bool:
+        """Whether FaceMesh can be skipped on this frame because nobody is in view"""
+        if self.absent < self.min_absent or self.skipped >= self.recheck_interval:
+            return False
+        thumbnail = self._thumbnail(frame)
+        if self.reference is None or cv2.absdiff(thumbnail, self.reference).mean() > self.motion_threshold:
+            if self.face_detection is None or self._face_detected(frame):
+                return False
+            # Something moved, but nothing that looks like a face: this is the empty scene now
+            self.reference = thumbnail
+        self.skipped += 1
+        return True
+
+    def record(self, frame: np.ndarray, found: bool):
+        """Feed back the result of a FaceMesh run on frame"""
+        self.skipped = 0
+        if found:
+            self.absent = 0
+            self.reference = None
+        else:
+            self.absent += 1
+            self.reference = self._thumbnail(frame)
+
+####### LANDMARK DETECTION / DECISION PIPELINE #################################################################################################################################
+
+# FaceMesh options of every detector, also part of the feature_cache key
+FACE_MESH_OPTIONS = {"refine_landmarks": True, "min_detection_confidence": 0.8}
+
+
+class LandmarkDetector:
+    """
+    FaceMesh wrapper returning the tracked landmarks of the first face as a normalized
+    (13, 2) full frame landmark array, or None when there is no face.
+    With keyframe_interval set, FaceMesh only runs on every keyframe_interval-th call (or sooner when the
+    track is lost), and the calls in between follow the landmarks with a LandmarkTracker.
+    tracked tells whether the last result came from the tracker.
+    With max_faces above 1, every detected face is returned as one (faces, 13, 2) array instead. Face crops
+    and tracking follow a single face, so they are not used in that mode.
+    With presence_gate set, a PresenceGate skips FaceMesh while nobody is in view; gated tells whether the
+    last None came from the gate.
+    """
+    def __init__(self, landmark_indices: Dict[str, int], roi_size: Optional[int] = None,
+                 keyframe_interval: Optional[int] = None, max_faces: int = 1, presence_gate: bool = False):
+        self.index_array = get_index_array(landmark_indices)
+        # Imported here so landmark replays and tools that never run FaceMesh do not need mediapipe
+        import mediapipe as mp
+        mp_face_mesh = mp.solutions.face_mesh
+        self.face_mesh = mp_face_mesh.FaceMesh(max_num_faces=max_faces, **FACE_MESH_OPTIONS)
+        self.multi_face = max_faces > 1
+        self.region = FaceRegion(roi_size) if roi_size and not self.multi_face else None
+        self.keyframe_interval = keyframe_interval
+        self.tracker = LandmarkTracker() if keyframe_interval and keyframe_interval > 1 and not self.multi_face else None
+        self.since_keyframe = 0
+        self.tracked = False
+        self.gate = None
+        if presence_gate:
+            # Short range BlazeFace, a few milliseconds on a small frame against tens for the refined mesh
+            self.gate = PresenceGate(mp.solutions.face_detection.FaceDetection(model_selection=0, min_detection_confidence=0.5))
+        self.gated = False
+
+    def process(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        if self.gate is not None and self.gate.skip(frame):
+            self.gated = True
+            self.tracked = False
+            return None
+        self.gated = False
+
+        if self.tracker is not None and self.since_keyframe < self.keyframe_interval - 1:
+            landmark_array = self.tracker.track(frame)
+            if landmark_array is not None:
+                self.since_keyframe += 1
+                self.tracked = True
+                if self.region is not None:
+                    self.region.update(landmark_array)
+                return landmark_array
+
+        self.tracked = False
+        self.since_keyframe = 0
+        landmark_array = self.detect(frame)
+        if self.gate is not None:
+            self.gate.record(frame, landmark_array is not None)
+        if self.tracker is not None:
+            if landmark_array is None:
+                self.tracker.reset()
+            else:
+                self.tracker.start(frame, landmark_array)
+        return landmark_array
+
+    def warm_up(self, frame_size: Tuple[int, int] = (640, 480)):
+        """Run FaceMesh once on a blank frame, so the first real sample does not pay for its initialisation"""
+        self.face_mesh.process(np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8))
+
+    def detect(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """Run FaceMesh on the frame"""
+        if self.region is not None:
+            rgb_frame = self.region.crop(frame)
+        else:
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        results = self.face_mesh.process(rgb_frame)
+
+        if not results.multi_face_landmarks:
+            if self.region is not None:
+                # Look for the face in the whole frame again
+                self.region.reset()
+            return None
+        if self.multi_face:
+            return np.stack([get_landmark_array(face, self.index_array) for face in results.multi_face_landmarks])
+
+        landmark_array = get_landmark_array(results.multi_face_landmarks[0], self.index_array)
+        if self.region is not None:
+            landmark_array = self.region.to_frame(landmark_array)
+            self.region.update(landmark_array)
+        return landmark_array
+
+    def close(self):
+        self.face_mesh.close()
+        if self.gate is not None:
+            self.gate.face_detection.close()
+
+
+class AttentionDecider:
+    """
+    Turns per-frame attention scores into play/pause decisions, and owns the AdaptiveScheduler that decides
+    which frames are sampled at all. Scores are smoothed by an exponential moving average with time constant
+    smoothing (seconds), which also handles the uneven spacing of idle samples, and the state only flips once
+    the average leaves the hysteresis band (low, high). Constant time and memory per sample.
+    """
+    def __init__(self, attention_threshold: float = 0.1, smoothing: float = 0.2, idle_interval: float = 0.3,
+                 hysteresis: Tuple[float, float] = (0.25, 0.75)):
+        self.smoothing = smoothing
+        self.low, self.high = hysteresis
+        self.score = None  # Smoothed attention score, None until the first sample
+        self.attention = False  # Track attention state to report only when it changes
+        self.scheduler = AdaptiveScheduler(attention_threshold, idle_interval)
+        # An idle sample stands in for at most this long, so no single sample can flip a settled state
+        self.max_gap = smoothing
+        self.last_time = None
+        self.stable = False  # Whether the last sample found the state settled
+        self.reserved = 0.0  # Time of the newest sample handed out by reserve()
+        self.resync = False  # Whether the next sample reports the state even if it did not flip
+        self.restarted = False  # Whether the last sample started a fresh score
+        self.sample_count = 0
+        self.change_started = None  # Time of the first sample disagreeing with the current state
+        self.flip_latency = None  # Seconds from that sample to the last flip
+
+    def due(self, now: float) -> bool:
+        return self.scheduler.due(now)
+
+    def update(self, now: float, sample: float) -> Optional[bool]:
+        """
+        Add a score in [0, 1] taken at time now. Returns the new attention state if it flipped, else None.
+        A non-finite score is ignored, it would stick in the average forever.
+        """
+        if not math.isfinite(sample):
+            return None
+        self.sample_count += 1
+        self.restarted = self.last_time is None
+        if (sample > 0.5) != self.attention:
+            if self.change_started is None:
+                self.change_started = now
+        else:
+            self.change_started = None
+
+        if self.score is None:
+            self.score = sample
+        else:
+            gap = min(max(now - self.last_time, 0.0), self.max_gap)
+            self.score += (1 - math.exp(-gap / self.smoothing)) * (sample - self.score)
+        self.last_time = now
+
+        changed = self.score < self.low if self.attention else self.score > self.high
+        if changed:
+            self.attention = not self.attention
+            self.flip_latency = now - (self.change_started if self.change_started is not None else now)
+            self.change_started = None
+
+        # Sample less often once the average has settled well beyond the band
+        self.stable = self.score > 1 - self.low / 2 if self.attention else self.score < self.low / 2
+        # Count from the newest sample taken, which is a later one when samples are in flight
+        self.scheduler.schedule(max(now, self.reserved), self.stable)
+        if self.resync and not changed:
+            self.flip_latency = 0.0
+        reported, self.resync = changed or self.resync, False
+        return self.attention if reported else None
+
+    def reset(self):
+        """
+        Forget the score and sample times, e.g. after the camera was off, but keep the attention state.
+        The next sample is taken right away and always returns the state, flipped or not.
+        """
+        self.score = None
+        self.last_time = None
+        self.change_started = None
+        self.stable = False
+        self.reserved = 0.0
+        self.scheduler.next_sample_time = 0.0
+        self.resync = True
+
+    def reserve(self, now: float):
+        """
+        Book the next sample after one taken at now whose score is still being computed. The interval follows
+        the newest sample decided so far, the one taken at now may still change it.
+        """
+        self.reserved = now
+        self.scheduler.schedule(now, self.stable)
+
+
+ATTENTION_POLICIES = ("any", "all", "primary")
+
+
+class ViewerTracker:
+    """
+    Gives the faces of a multi-face sample stable viewer IDs and combines their attention scores.
+    Faces are matched to the viewers of the previous samples by the centre of their landmarks, closest pairs
+    first, as long as they moved less than max_distance (normalized frame units). A viewer that is not seen
+    for more than max_missing samples is forgotten, new faces get new IDs.
+    Policies: "any" plays while any viewer is attentive, "all" only while every visible viewer is, and
+    "primary" follows the viewer that has been watching the longest (the lowest ID still known).
+    """
+    def __init__(self, policy: str = "any", max_distance: float = 0.15, max_missing: int = 5):
+        if policy not in ATTENTION_POLICIES:
+            raise ValueError(f"Unknown attention policy {policy!r}, expected one of {ATTENTION_POLICIES}")
+        self.policy = policy
+        self.max_distance = max_distance
+        self.max_missing = max_missing
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.centres = np.zeros((0, 2), dtype=np.float32)
+        self.missing = np.zeros(0, dtype=np.int64)
+        self.next_id = 1
+
+    def assign(self, faces: np.ndarray) -> np.ndarray:
+        """Viewer IDs for a (faces, 13, 2) landmark array"""
+        centres = faces.mean(axis=-2)
+        distances = np.linalg.norm(self.centres[:, None, :] - centres[None, :, :], axis=-1)
+        face_ids = np.zeros(len(faces), dtype=np.int64)
+        matched = np.zeros(len(self.ids), dtype=bool)
+        for flat in np.argsort(distances, axis=None):
+            viewer, face = divmod(int(flat), len(faces))
+            if distances[viewer, face] > self.max_distance:
+                break
+            if not matched[viewer] and face_ids[face] == 0:
+                matched[viewer] = True
+                face_ids[face] = self.ids[viewer]
+                self.centres[viewer] = centres[face]
+
+        new = face_ids == 0
+        face_ids[new] = np.arange(self.next_id, self.next_id + new.sum())
+        self.next_id += int(new.sum())
+        self.missing = np.where(matched, 0, self.missing + 1)
+        keep = self.missing <= self.max_missing
+        self.ids = np.concatenate([self.ids[keep], face_ids[new]])
+        self.centres = np.concatenate([self.centres[keep], centres[new]])
+        self.missing = np.concatenate([self.missing[keep], np.zeros(int(new.sum()), dtype=np.int64)])
+        return face_ids
+
+    def forget_missing(self):
+        """Age every viewer by one sample without faces"""
+        self.assign(np.zeros((0, 1, 2), dtype=np.float32))
+
+    def combine(self, face_ids: np.ndarray, scores: np.ndarray) -> float:
+        if len(scores) == 0:
+            return 0.0
+        if self.policy == "any":
+            return float(scores.max())
+        if self.policy == "all":
+            return float(scores.min())
+        # The primary viewer only counts while visible, looking away from the frame is not attention
+        primary = face_ids == self.ids.min()
+        return float(scores[primary][0]) if primary.any() else 0.0
+
+
+def get_sample(landmark_array: Optional[np.ndarray], threshold_array: np.ndarray,
+               viewers: Optional[ViewerTracker] = None, ratio_array: Optional[np.ndarray] = None) -> float:
+    """
+    Attention score of a single frame; no face means no attention.
+    A (faces, 13, 2) array is scored in one batch and combined by viewers.
+    ratio_array passes in the ratios of landmark_array when they are computed already.
+    """
+    if landmark_array is None:
+        if viewers is not None:
+            viewers.forget_missing()
+        return 0.0
+    if ratio_array is None:
+        ratio_array = get_ratio_array(landmark_array)
+    scores = get_attention_score_array(ratio_array, threshold_array)
+    if landmark_array.ndim == 3:
+        return viewers.combine(viewers.assign(landmark_array), scores)
+    return float(scores)
+
+
+def run_attention_loop(source, detector: Optional[LandmarkDetector], decider: AttentionDecider,
+                       threshold_store: ThresholdStore, on_decision: Callable[[float, bool, int], None],
+                       stop_event: Optional[threading.Event] = None, metrics: Metrics = NULL_METRICS,
+                       viewers: Optional[ViewerTracker] = None, recorder: Optional[FlightRecorder] = None):
+    """
+    The frame -> landmarks -> ratios -> directions -> attention -> decision chain, shared by the live
+    engine and offline replays. Frames the decider does not need are grabbed but never decoded.
+    on_decision(timestamp, attention, frame) is called on every flip, frame is the index of the decided frame
+    in the source. Runs until the source runs dry or stop_event
+    is set, and returns True in the second case. detector may be None for landmark sources.
+    viewers is required when the detector or source returns several faces per frame.
+    Frame rate, skipped frames, inference time and gaze change to decision latency go to metrics, and for
+    live sources also the age of every sampled frame and the capture to decision latency.
+    Every sample is written to recorder if one is given.
+    """
+    while source.isOpened():
+        if stop_event is not None and stop_event.is_set():
+            return True
+        if not source.grab():
+            break
+        now = source.timestamp
+        metrics.tick("frames", now)
+        if not decider.due(now):
+            metrics.increment("frames_skipped")
+            continue
+
+        ret, item = source.retrieve()
+        if not ret:
+            break
+        if source.live:
+            # Cameras decode the newest frame on retrieve(), which may be newer than the one grabbed
+            now = source.timestamp
+            # How long the frame waited before the pipeline got to it
+            metrics.observe("frame_age", time.monotonic() - now)
+            metrics.set_gauge("frames_dropped", source.dropped)
+        if source.yields_landmarks:
+            landmark_array = item
+        else:
+            start = time.perf_counter()
+            landmark_array = detector.process(item)
+            # Tracked and gated samples are timed separately so the FaceMesh histogram stays comparable
+            stage = "presence_check" if detector.gated else "tracking" if detector.tracked else "inference"
+            metrics.observe(stage, time.perf_counter() - start)
+        metrics.increment("samples")
+
+        # Cached thresholds, re-read only when the file changes
+        threshold_array = threshold_store.get_array()
+        # Computed here so the flight recorder can keep them
+        ratio_array = None if landmark_array is None else get_ratio_array(landmark_array)
+        sample = get_sample(landmark_array, threshold_array, viewers, ratio_array)
+        new_attention = decider.update(now, sample)
+        if recorder is not None:
+            recorder.record(now, landmark_array, ratio_array, threshold_array, sample, decider,
+                            new_attention is not None, detector is not None and detector.tracked,
+                            detector is not None and detector.gated)
+        if new_attention is not None:
+            metrics.observe("decision_latency", decider.flip_latency)
+            if source.live:
+                metrics.observe("capture_to_decision", time.monotonic() - now)
+            metrics.increment("decisions")
+            on_decision(now, new_attention, source.frame_count - 1)
+
+def run_pipelined_loop(source, pool: InferencePool, decider: AttentionDecider, threshold_store: ThresholdStore,
+                       on_decision: Callable[[float, bool, int], None], stop_event: Optional[threading.Event] = None,
+                       metrics: Metrics = NULL_METRICS, viewers: Optional[ViewerTracker] = None,
+                       recorder: Optional[FlightRecorder] = None):
+    """
+    run_attention_loop with FaceMesh in the worker processes of pool. This thread captures frames and hands
+    the sampled ones to the workers; a decision thread takes the results in capture order and runs the
+    ratio, attention and decision steps on them. Samples in flight per pool.slots, see InferencePool.
+    Which frame is sampled next depends on the decisions still in flight. Recorded sources sample a frame
+    that some outcomes of those decisions make due (see AdaptiveScheduler.reachable) while a worker is idle,
+    and otherwise wait for the outcome; the decision thread only keeps the samples the scheduler actually
+    picks, so the decisions match run_attention_loop exactly. Live sources keep sampling at the interval of
+    the newest decision instead, see AttentionDecider.reserve.
+    Returns True when stop_event ended the loop, like run_attention_loop. An error in the decision thread, a
+    dead worker, or workers that stop answering for pool.result_timeout seconds are raised here.
+    """
+    captured = {}  # sequence -> (source timestamp, frame index, monotonic submit time), until the result is decided
+    settled = threading.Condition()  # Notified whenever captured shrinks or the decision thread ends
+    finished = threading.Event()  # Set once the decision thread has stopped
+    errors = []
+
+    def check_workers():
+        if not pool.alive():
+            raise RuntimeError("An inference worker died")
+
+    def decide():
+        pending = {}
+        expected = 0
+        waiting_since = time.monotonic()
+        try:
+            while True:
+                try:
+                    result = pool.results.get(timeout=0.5)
+                except queue.Empty:
+                    check_workers()
+                    with settled:
+                        busy = bool(captured)
+                    if not busy:
+                        waiting_since = time.monotonic()
+                    elif time.monotonic() - waiting_since > pool.result_timeout:
+                        raise RuntimeError(f"Inference workers gave no result for {pool.result_timeout:.0f} seconds")
+                    continue
+                waiting_since = time.monotonic()
+                if result is None:
+                    break
+                sequence, slot, landmark_array, seconds = result
+                pool.release(slot)
+                metrics.observe("inference", seconds)
+                pending[sequence] = landmark_array
+                # Workers finish out of order, decisions are made in capture order
+                while expected in pending:
+                    landmark_array = pending.pop(expected)
+                    now, frame_index, submitted = captured[expected]
+                    metrics.observe("pipeline_latency", time.monotonic() - submitted)
+                    if source.live or decider.due(now):
+                        threshold_array = threshold_store.get_array()
+                        ratio_array = None if landmark_array is None else get_ratio_array(landmark_array)
+                        sample = get_sample(landmark_array, threshold_array, viewers, ratio_array)
+                        new_attention = decider.update(now, sample)
+                        if recorder is not None:
+                            recorder.record(now, landmark_array, ratio_array, threshold_array, sample, decider,
+                                            new_attention is not None)
+                        if new_attention is not None:
+                            metrics.observe("decision_latency", decider.flip_latency)
+                            if source.live:
+                                metrics.observe("capture_to_decision", time.monotonic() - now)
+                            metrics.increment("decisions")
+                            on_decision(now, new_attention, frame_index)
+                    else:
+                        # Sampled for an outcome that did not happen
+                        metrics.increment("samples_discarded")
+                    with settled:
+                        del captured[expected]
+                        settled.notify_all()
+                    expected += 1
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            with settled:
+                finished.set()
+                settled.notify_all()
+
+    def wait_settled():
+        # Hung workers end the decision thread, which sets finished
+        with settled:
+            while captured and not finished.is_set():
+                if not settled.wait(0.5):
+                    check_workers()
+        if errors:
+            raise errors[0]
+
+    def due(now: float) -> bool:
+        if source.live:
+            return decider.due(now)
+        with settled:
+            while True:
+                # The scheduler only moves in the decision thread, before captured shrinks
+                pending = [captured[sequence][0] for sequence in sorted(captured)]
+                due = [decider.scheduler.due(now, candidate) for candidate in decider.scheduler.reachable(pending)]
+                # A frame only some outcomes sample is worth an idle worker, otherwise wait for the outcome
+                if all(due) or not any(due) or len(captured) < pool.workers or finished.is_set():
+                    return any(due)
+                if not settled.wait(0.5):
+                    check_workers()
+
+    decision_thread = threading.Thread(target=decide, daemon=True)
+    decision_thread.start()
+    sequence = 0
+    slot = None
+    interrupted = False
+    try:
+        while source.isOpened():
+            if errors:
+                raise errors[0]
+            if stop_event is not None and stop_event.is_set():
+                interrupted = True
+                break
+            if slot is None:
+                slot = pool.acquire(timeout=0.1)
+                if slot is None:
+                    check_workers()
+                    # Every slot is in flight, newer camera frames replace the ones waiting meanwhile
+                    continue
+            if not source.grab():
+                break
+            now = source.timestamp
+            metrics.tick("frames", now)
+            if not due(now):
+                metrics.increment("frames_skipped")
+                continue
+
+            ret, frame = source.retrieve()
+            if not ret:
+                break
+            if source.live:
+                now = source.timestamp
+                metrics.observe("frame_age", time.monotonic() - now)
+                metrics.set_gauge("frames_dropped", source.dropped)
+            with settled:
+                captured[sequence] = (now, source.frame_count - 1, time.monotonic())
+            pool.submit(sequence, slot, frame)
+            if source.live:
+                decider.reserve(now)
+            sequence += 1
+            slot = None
+            metrics.increment("samples")
+            metrics.set_gauge("pipeline_in_flight", pool.in_flight())
+
+        # Let the samples in flight reach a decision, the next run starts its sequence numbers over
+        wait_settled()
+    finally:
+        if slot is not None and pool.ring is not None:
+            # Taken for a frame that was never submitted
+            pool.release(slot)
+        pool.results.put(None)
+        decision_thread.join()
+    if errors:
+        raise errors[0]
+    return interrupted
+
+####### SHARED CAPTURE / INFERENCE ENGINE ######################################################################################################################################
+
+class Decision(NamedTuple):
+    """One published attention transition"""
+    message: str  # "play" or "pause"
+    decided_at: float  # Source timestamp of the decision, see frame_sources
+    sequence: int  # Grows by one with every decision while the process runs
+    timestamp: float  # Wall clock time of the decision
+
+
+class AttentionEngine:
+    """
+    Owns the single camera and FaceMesh instance of the server, and runs run_attention_loop on them.
+    Capture, inference and the attention decision run in one background thread, and every
+    attention transition ("play" / "pause") is fanned out to all subscribed connections through
+    small bounded asyncio queues. The camera and model are opened once, on the first subscription or an
+    explicit start(). They are opened and warmed up concurrently, and the ready event is set once both can
+    deliver; startup times are measured from metrics.start_time.
+    Once no subscriber is left, or every subscriber reported that it has no video to control (see set_video),
+    the engine goes idle after idle_delay seconds: the camera is released and nothing is sampled, but the model
+    stays loaded. An engine started before anybody subscribed counts from the moment it is ready. The next
+    interested subscriber resumes it; reopening the camera and the first decision after that are measured as
+    resume_to_ready and resume_to_decision. stop() shuts everything down for good.
+    FaceMesh only runs when the AdaptiveScheduler asks for a sample, see idle_interval.
+    With roi_size set, FaceMesh runs on a downscaled crop around the face, see FaceRegion.
+    With keyframe_interval set, samples between FaceMesh keyframes are tracked with optical flow, see LandmarkTracker.
+    With max_faces above 1, up to max_faces viewers are scored together and combined by policy, see ViewerTracker.
+    Cameras are read through a frame_sources.LatestFrameCamera, so samples are never taken from stale buffered frames.
+    With workers set, FaceMesh runs in that many processes fed through shared memory, see run_pipelined_loop.
+    With presence_gate set (the default), FaceMesh is skipped while nobody is in view, see PresenceGate.
+    Every sample goes to a FlightRecorder holding the last flight_capacity samples, memory mapped to the file
+    flight_recorder if given, so a wrong pause can be looked at and replayed later. 0 turns it off.
+    Subscriber queues carry Decision tuples, a None item means the camera stream ended.
+    """
+    def __init__(self, landmark_indices: Dict[str, int], threshold_store: Optional[ThresholdStore] = None,
+                 attention_threshold: float = 0.1, smoothing: float = 0.2, idle_interval: float = 0.3,
+                 roi_size: Optional[int] = None, source: Union[int, str] = 0, metrics: Optional[Metrics] = None,
+                 keyframe_interval: Optional[int] = None, max_faces: int = 1, policy: str = "any",
+                 capture: Optional[CaptureSettings] = None, workers: int = 0, presence_gate: bool = True,
+                 idle_delay: float = 2.0, flight_recorder: Optional[str] = None, flight_capacity: int = 18000):
+        self.landmark_indices = landmark_indices
+        self.source = source  # Camera index, video file, image directory or landmark dump, see frame_sources
+        self.capture = capture  # Camera resolution, frame rate and pixel format, None keeps the driver defaults
+        self.workers = workers  # FaceMesh worker processes, 0 runs FaceMesh in the engine thread
+        self.presence_gate = presence_gate  # Skip FaceMesh while nobody is in view, see PresenceGate
+        self.idle_delay = idle_delay  # Seconds without an interested subscriber before the camera is released
+        self.threshold_store = threshold_store or ThresholdStore()
+        self.attention_threshold = attention_threshold  # Seconds between attention decisions
+        self.idle_interval = idle_interval  # Seconds between samples while the state is stable
+        self.roi_size = roi_size  # Longer side of the face crop in pixels, None runs on the full frame
+        self.keyframe_interval = keyframe_interval  # Samples per FaceMesh run, None runs FaceMesh on every sample
+        self.max_faces = max_faces
+        self.policy = policy  # How the attention of several viewers is combined, one of ATTENTION_POLICIES
+        self.smoothing = smoothing  # Time constant of the attention score average in seconds
+        self.metrics = metrics or Metrics()
+        self.recorder = FlightRecorder(flight_recorder, flight_capacity) if flight_capacity else None
+        self.message = None  # Last published Decision, only touched by the event loop
+        self.sequence = 0  # Sequence number of the last decision, only touched by the engine thread
+        self.ready = None  # asyncio.Event, set once the camera and model are warmed up
+        self.ready_after = None  # Seconds from metrics.start_time until then
+        self.first_decision_after = None  # Seconds from metrics.start_time until the first decision
+
+        self.loop = None
+        self.subscribers = set()
+        self.without_video = set()  # Subscribers whose client reported that it has no video to control
+        self.stop_event = threading.Event()
+        self.active = threading.Event()  # Set while somebody wants decisions, the engine thread idles otherwise
+        self.interrupt = threading.Event()  # Makes the running attention loop return, to idle or to stop
+        self.suspend_handle = None  # Pending idle_delay timer on the event loop
+        self.resume_requested = None  # Monotonic time of the last resume request, until its first decision
+        self.thread = None
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Open the camera and model and start the engine thread if it is not running yet"""
+        if self.is_running():
+            return
+        self.loop = loop
+        self.message = None
+        if self.suspend_handle is not None:
+            self.suspend_handle.cancel()
+            self.suspend_handle = None
+        self.ready = asyncio.Event()
+        self.stop_event.clear()
+        self.interrupt.clear()
+        self.active.set()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        # Nobody may be interested yet, e.g. when the server warms up at startup
+        self._update_activity()
+
+    def stop(self, timeout: float = 1.0):
+        """Ask the engine thread to exit and wait for it to release the camera"""
+        self.stop_event.set()
+        self.interrupt.set()
+        # Wake an idle engine thread so it can exit
+        self.active.set()
+        if self.is_running():
+            self.thread.join(timeout=timeout)
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Register a new listener and return its queue of attention messages.
+        Only the latest message is kept, so a slow connection never sees a stale state.
+        Must be called from the event loop thread.
+        """
+        queue = asyncio.Queue(maxsize=1)
+        if self.message is not None:
+            # Bring the new connection up to date with the current state
+            queue.put_nowait(self.message)
+        self.subscribers.add(queue)
+        self.metrics.set_gauge("subscribers", len(self.subscribers))
+        self.start(asyncio.get_running_loop())
+        self._update_activity()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        self.without_video.discard(queue)
+        self.metrics.set_gauge("subscribers", len(self.subscribers))
+        self._update_activity()
+
+    def set_video(self, queue: asyncio.Queue, playing: bool):
+        """Record whether the client behind a subscriber queue has a video to control, on the event loop"""
+        if playing:
+            self.without_video.discard(queue)
+        else:
+            self.without_video.add(queue)
+        self._update_activity()
+
+    def _update_activity(self):
+        """Resume right away when somebody is interested, go idle after idle_delay when nobody is"""
+        if not self.is_running():
+            return
+        if self.subscribers - self.without_video:
+            if self.suspend_handle is not None:
+                self.suspend_handle.cancel()
+                self.suspend_handle = None
+            if not self.active.is_set():
+                self.resume_requested = time.monotonic()
+                self.interrupt.clear()
+                self.active.set()
+        elif self.ready.is_set() and self.active.is_set() and self.suspend_handle is None:
+            # Only once warmed up, so a warm start still loads the model and opens the camera in full
+            self.suspend_handle = self.loop.call_later(self.idle_delay, self._suspend)
+
+    def _set_ready(self):
+        self.ready.set()
+        # Nobody may have subscribed to a warm start, which then idles like any other engine
+        self._update_activity()
+
+    def _suspend(self):
+        self.suspend_handle = None
+        self.active.clear()
+        self.interrupt.set()
+
+    def _open_source(self):
+        source = open_source(self.source, capture=self.capture)
+        source.warm_up()
+        return source
+
+    def _open(self):
+        """Open and warm up the source in a helper thread while the model loads in this one"""
+        with ThreadPoolExecutor(max_workers=1) as opener:
+            opening = opener.submit(self._open_source)
+            detector = None
+            try:
+                if self.workers and not yields_landmarks(self.source):
+                    detector = InferencePool(self.landmark_indices, self.workers, self.max_faces)
+                elif not yields_landmarks(self.source):
+                    detector = LandmarkDetector(self.landmark_indices, self.roi_size, self.keyframe_interval, self.max_faces,
+                                                self.presence_gate)
+                if detector is not None:
+                    detector.warm_up()
+            except BaseException:
+                if detector is not None:
+                    detector.close()
+                try:
+                    opening.result().release()
+                except Exception:
+                    # The source failed too, the model error is the one raised
+                    pass
+                raise
+            try:
+                source = opening.result()
+            except BaseException:
+                if detector is not None:
+                    detector.close()
+                raise
+        return source, detector
+
+    def _run(self):
+        """Capture, inference and decision loop, runs in the engine thread"""
+        try:
+            source, detector = self._open()
+        except Exception:
+            # Let the subscribers know there will be no decisions
+            self._publish_threadsafe(None)
+            raise
+        self.ready_after = time.monotonic() - self.metrics.start_time
+        self.metrics.set_gauge("startup_ready_s", round(self.ready_after, 3))
+        self._call_threadsafe(self._set_ready)
+        decider = AttentionDecider(self.attention_threshold, self.smoothing, self.idle_interval)
+        viewers = ViewerTracker(self.policy)
+        if self.recorder is not None:
+            self.recorder.configure(decider)
+        run_loop = run_pipelined_loop if isinstance(detector, InferencePool) else run_attention_loop
+        try:
+            while True:
+                # Every active period starts with a fresh score and reports the state on its first sample
+                decider.reset()
+                # The interrupt may already be cleared again by a resume, only the loop knows why it returned
+                interrupted = run_loop(source, detector, decider, self.threshold_store, self._decide,
+                                       self.interrupt, self.metrics, viewers, self.recorder)
+                if self.stop_event.is_set() or not interrupted:
+                    # Stopped, or the source ran dry
+                    break
+                source = self._idle(source)
+                if source is None:
+                    break
+        finally:
+            if source is not None:
+                source.release()
+            if detector is not None:
+                detector.close()
+            if self.recorder is not None:
+                self.recorder.flush()
+            self._publish_threadsafe(None)
+
+    def _idle(self, source):
+        """Release the camera until somebody is interested again, returns the reopened source or None on stop"""
+        if self.active.is_set():
+            # Resumed before the loop noticed it should idle
+            return source
+        source.release()
+        self._call_threadsafe(self._forget_message)
+        self.metrics.set_gauge("idle", 1)
+        print("Nobody watching, camera released")
+        self.active.wait()
+        if self.stop_event.is_set():
+            return None
+        self.metrics.set_gauge("idle", 0)
+        source = self._open_source()
+        resume_requested = self.resume_requested
+        if resume_requested is not None:
+            self.metrics.observe("resume_to_ready", time.monotonic() - resume_requested)
+        print("Resumed, camera reopened")
+        return source
+
+    def _forget_message(self):
+        # Nothing is known about the viewer while idle, new subscribers wait for the first decision after the resume
+        self.message = None
+
+    def _decide(self, now: float, attention: bool, frame: int):
+        if self.first_decision_after is None:
+            self.first_decision_after = time.monotonic() - self.metrics.start_time
+            self.metrics.set_gauge("startup_first_decision_s", round(self.first_decision_after, 3))
+        if self.resume_requested is not None:
+            self.metrics.observe("resume_to_decision", time.monotonic() - self.resume_requested)
+            self.resume_requested = None
+        self.sequence += 1
+        self._publish_threadsafe(Decision("play" if attention else "pause", now, self.sequence, time.time()))
+
+    def _publish_threadsafe(self, message: Optional[Decision]):
+        self._call_threadsafe(self._publish, message)
+
+    def _call_threadsafe(self, callback, *args):
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # Event loop already closed, nobody is listening anymore
+            pass
+
+    def _publish(self, message: Optional[Decision]):
+        """Fan a message out to every subscriber, replacing anything they have not consumed yet"""
+        if message is not None:
+            self.message = message
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.metrics.increment("messages_coalesced")
+            queue.put_nowait(message)
+        self.metrics.set_gauge("subscribers", len(self.subscribers))
+        self.metrics.set_gauge("queue_depth", max((queue.qsize() for queue in self.subscribers), default=0))
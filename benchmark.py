@@ -0,0 +1,329 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import cv2
+import numpy as np
+from helpers import LANDMARK_INDICES, LANDMARK_NAMES, get_ratio_array, get_direction_array, get_attention_array
+from threshold_store import ThresholdStore, THRESHOLDS_FILE
+from frame_sources import LandmarkSource, open_source
+from attention_engine import AttentionDecider, LandmarkDetector, LandmarkTracker, get_sample, run_attention_loop
+from flight_recorder import FlightRecorder
+
+####### STATISTICS #############################################################################################################################################################
+
+def summarize(durations) -> dict:
+    """Latency percentiles in milliseconds and throughput in items per second for a list of durations in seconds"""
+    if len(durations) == 0:
+        return {"count": 0}
+    durations = np.asarray(durations, dtype=np.float64)
+    p50, p90, p99 = np.percentile(durations, [50, 90, 99]) * 1000
+    total = durations.sum()
+    return {
+        "count": int(len(durations)),
+        "mean_ms": round(float(durations.mean()) * 1000, 4),
+        "p50_ms": round(float(p50), 4),
+        "p90_ms": round(float(p90), 4),
+        "p99_ms": round(float(p99), 4),
+        "max_ms": round(float(durations.max()) * 1000, 4),
+        "throughput_per_s": round(len(durations) / total, 1) if total > 0 else None,
+    }
+
+
+def time_each(function, items) -> list:
+    durations = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+####### SYNTHETIC INPUT ########################################################################################################################################################
+
+# A centred, attentive pose in LANDMARK_NAMES order (normalized coordinates)
+CENTER_POSE = {
+    "LEFT_EYE_OUTER": (0.30, 0.40), "LEFT_EYE_INNER": (0.40, 0.40),
+    "RIGHT_EYE_OUTER": (0.70, 0.40), "RIGHT_EYE_INNER": (0.60, 0.40),
+    "LEFT_EYE_TOP": (0.35, 0.38), "LEFT_EYE_BOTTOM": (0.35, 0.43),
+    "RIGHT_EYE_TOP": (0.65, 0.38), "RIGHT_EYE_BOTTOM": (0.65, 0.43),
+    "LEFT_PUPIL": (0.35, 0.40), "RIGHT_PUPIL": (0.65, 0.40),
+    "NOSE": (0.50, 0.53), "CHIN": (0.50, 0.80), "FOREHEAD": (0.50, 0.20),
+}
+
+def synthetic_landmarks(count: int = 3000, fps: float = 30.0, away_every: float = 4.0, away_duration: float = 1.5,
+                        jitter: float = 0.0005, seed: int = 0):
+    """
+    Landmark stream of a viewer who looks away (face lost) for away_duration seconds every away_every seconds.
+    Returns (landmarks (N, 13, 2) with NaN rows for no face, timestamps, attentive labels).
+    """
+    rng = np.random.default_rng(seed)
+    center = np.array([CENTER_POSE[name] for name in LANDMARK_NAMES], dtype=np.float32)
+    timestamps = np.arange(count) / fps
+    labels = (timestamps % away_every) < (away_every - away_duration)
+    landmarks = center + rng.normal(0, jitter, (count,) + center.shape).astype(np.float32)
+    landmarks[~labels] = np.nan
+    return landmarks, timestamps, labels
+
+####### STAGES #################################################################################################################################################################
+
+def bench_decode(source, limit: int):
+    """
+    Grab + decode time per frame. Also returns the decoded frames for the later stages,
+    and whether they are landmark arrays rather than images.
+    """
+    frame_source = open_source(source)
+    frames, durations = [], []
+    try:
+        while len(frames) < limit:
+            start = time.perf_counter()
+            ret, frame = frame_source.read()
+            if not ret:
+                break
+            durations.append(time.perf_counter() - start)
+            frames.append(frame)
+    finally:
+        frame_source.release()
+    return frames, durations, frame_source.yields_landmarks
+
+
+def bench_color(frames):
+    return time_each(lambda frame: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), frames)
+
+
+def bench_facemesh(frames, roi_size=None):
+    """FaceMesh time per frame (including the face crop when roi_size is set). Also returns the landmark arrays"""
+    detector = LandmarkDetector(LANDMARK_INDICES, roi_size)
+    landmark_arrays = []
+    try:
+        durations = time_each(lambda frame: landmark_arrays.append(detector.process(frame)), frames)
+    finally:
+        detector.close()
+    return landmark_arrays, durations
+
+
+def bench_tracking(frames, landmark_arrays):
+    """
+    Optical flow time per frame, tracking the FaceMesh landmarks of each frame into the next one.
+    Also returns how far the tracked points end up from FaceMesh's, in pixels, and how often the track was lost.
+    """
+    tracker = LandmarkTracker()
+    durations, errors, lost = [], [], 0
+    for i in range(1, len(frames)):
+        if landmark_arrays[i - 1] is None or landmark_arrays[i] is None:
+            continue
+        tracker.start(frames[i - 1], landmark_arrays[i - 1])
+        start = time.perf_counter()
+        tracked = tracker.track(frames[i])
+        durations.append(time.perf_counter() - start)
+        if tracked is None:
+            lost += 1
+            continue
+        h, w = frames[i].shape[:2]
+        errors.append(float(np.abs((tracked - landmark_arrays[i]) * np.array([w, h])).max()))
+    error = {"lost": lost}
+    if errors:
+        error.update({"mean_px": round(float(np.mean(errors)), 3), "p90_px": round(float(np.percentile(errors, 90)), 3)})
+    return durations, error
+
+
+def bench_ratio_math(landmark_arrays, threshold_array):
+    """Per-frame ratio/direction/attention math, and the same math batched over all frames with a face"""
+    per_frame = time_each(lambda landmark_array: get_sample(landmark_array, threshold_array), landmark_arrays)
+    faces = [landmark_array for landmark_array in landmark_arrays if landmark_array is not None]
+    batch = {}
+    if faces:
+        stacked = np.stack(faces)
+        start = time.perf_counter()
+        get_attention_array(get_direction_array(get_ratio_array(stacked), threshold_array))
+        elapsed = time.perf_counter() - start
+        batch = {"frames": len(faces), "total_ms": round(elapsed * 1000, 4),
+                 "per_frame_us": round(elapsed / len(faces) * 1e6, 4)}
+    return per_frame, batch
+
+
+def bench_decision(samples, timestamps):
+    """Score filter, hysteresis and scheduling, one call per sample"""
+    decider = AttentionDecider(idle_interval=0.1)
+    durations = []
+    for sample, timestamp in zip(samples, timestamps):
+        start = time.perf_counter()
+        decider.update(float(timestamp), float(sample))
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def bench_flight_recorder(landmark_arrays, samples, threshold_array):
+    """Writing each sample to an in-memory FlightRecorder, on top of the decision"""
+    recorder = FlightRecorder(capacity=1000)
+    decider = AttentionDecider(idle_interval=0.1)
+    durations = []
+    for i, (landmark_array, sample) in enumerate(zip(landmark_arrays, samples)):
+        reported = decider.update(i * 0.1, float(sample)) is not None
+        # The pipeline hands over the ratios it scored the sample with
+        ratio_array = None if landmark_array is None else get_ratio_array(landmark_array)
+        start = time.perf_counter()
+        recorder.record(i * 0.1, landmark_array, ratio_array, threshold_array, sample, decider, reported)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def bench_decision_latency(landmarks, timestamps, labels, threshold_store, idle_interval: float = 0.3):
+    """
+    End-to-end decision latency in stream time: seconds from each ground truth change of attention to
+    the matching play/pause decision, running the full pipeline over a landmark stream.
+    Also returns the wall clock time spent per sampled frame.
+    """
+    # The pipeline starts out paused, so an attentive first frame counts as a change too
+    changes = [(float(timestamps[i]), bool(labels[i])) for i in range(len(labels))
+               if labels[i] != (labels[i - 1] if i > 0 else False)]
+    decisions = []
+    decider = AttentionDecider(idle_interval=idle_interval)
+    start = time.perf_counter()
+    run_attention_loop(LandmarkSource(landmarks, timestamps=timestamps), None, decider, threshold_store,
+                       lambda timestamp, attention, frame: decisions.append((timestamp, attention)))
+    elapsed = time.perf_counter() - start
+
+    # Match every change with the first decision for the new state before the next change
+    delays = []
+    for i, (change_time, attention) in enumerate(changes):
+        next_change_time = changes[i + 1][0] if i + 1 < len(changes) else float('inf')
+        matching = [timestamp for timestamp, decided in decisions
+                    if decided == attention and change_time <= timestamp < next_change_time]
+        if matching:
+            delays.append(matching[0] - change_time)
+    result = summarize(delays)
+    result.pop("throughput_per_s", None)
+    result["missed"] = len(changes) - len(delays)
+    result["spurious"] = len(decisions) - len(delays)
+    result["wall_us_per_sample"] = round(elapsed / max(decider.sample_count, 1) * 1e6, 4)
+    return result
+
+
+def bench_websocket(count: int = 200):
+    """
+    Round trip of a decision and its ack over a local websocket connection: the server side is a
+    MessageDelivery speaking the attention.v1 protocol, the client acks every state frame cumulatively
+    like extension/background.js.
+    """
+    import io
+    import contextlib
+    # Imported here so the other stages run without websockets installed
+    import websockets
+    from delivery import MessageDelivery
+    from attention_engine import Decision
+    from protocol import SUBPROTOCOL, SNAPSHOT, STATE, ACK
+
+    async def run():
+        durations = []
+        done = asyncio.Event()
+
+        async def handler(websocket, path=None):
+            delivery = MessageDelivery(websocket)
+            delivery.start()
+            try:
+                for sequence in range(1, count + 1):
+                    decision = Decision("play" if sequence % 2 else "pause", time.monotonic(), sequence, time.time())
+                    start = time.perf_counter()
+                    delivery.ack_received.clear()
+                    delivery.deliver(decision)
+                    while delivery.acknowledged < sequence:
+                        await asyncio.wait_for(delivery.ack_received.wait(), delivery.ack_timeout * delivery.max_retries)
+                        delivery.ack_received.clear()
+                    durations.append(time.perf_counter() - start)
+            finally:
+                await delivery.close()
+                done.set()
+
+        server = await websockets.serve(handler, "localhost", 0, subprotocols=[SUBPROTOCOL])
+        port = next(iter(server.sockets)).getsockname()[1]
+        async with websockets.connect(f"ws://localhost:{port}", subprotocols=[SUBPROTOCOL]) as client:
+            async def ack():
+                async for data in client:
+                    frame = json.loads(data)
+                    if frame["t"] in (SNAPSHOT, STATE):
+                        await client.send(json.dumps({"t": ACK, "q": frame["q"]}, separators=(',', ':')))
+            ack_task = asyncio.ensure_future(ack())
+            await done.wait()
+            ack_task.cancel()
+        server.close()
+        await server.wait_closed()
+        return durations
+
+    # MessageDelivery prints every message it sends and every ack, keep that out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(run())
+
+####### MAIN ###################################################################################################################################################################
+
+def run_benchmarks(source=None, frames: int = 300, synthetic: int = 3000, thresholds_path: str = THRESHOLDS_FILE,
+                   roi_size=None, websocket_messages: int = 200) -> dict:
+    """Run every stage that the given inputs allow and return the results as a JSON-serializable dictionary"""
+    threshold_store = ThresholdStore(thresholds_path)
+    threshold_array = threshold_store.get_array()
+    stages = {}
+
+    landmarks, timestamps, labels = synthetic_landmarks(synthetic)
+    landmark_arrays = [None if np.isnan(row).any() else row for row in landmarks]
+
+    if source is not None:
+        decoded, durations, yields_landmarks = bench_decode(source, frames)
+        stages["decode"] = summarize(durations)
+        if yields_landmarks:
+            # Landmark dumps replace the synthetic stream for the math stages
+            landmark_arrays = decoded
+        elif decoded:
+            stages["color_conversion"] = summarize(bench_color(decoded))
+            try:
+                landmark_arrays, durations = bench_facemesh(decoded, roi_size)
+                stages["facemesh"] = summarize(durations)
+                durations, error = bench_tracking(decoded, landmark_arrays)
+                stages["tracking"] = summarize(durations)
+                stages["tracking"]["error"] = error
+            except ImportError as e:
+                stages["facemesh"] = {"skipped": str(e)}
+
+    per_frame, batch = bench_ratio_math(landmark_arrays, threshold_array)
+    stages["ratio_math"] = summarize(per_frame)
+    stages["ratio_math"]["batch"] = batch
+
+    samples = [get_sample(landmark_array, threshold_array) for landmark_array in landmark_arrays]
+    stages["decision"] = summarize(bench_decision(samples, np.arange(len(samples)) * 0.1))
+    stages["flight_recorder"] = summarize(bench_flight_recorder(landmark_arrays, samples, threshold_array))
+
+    if websocket_messages:
+        try:
+            stages["websocket_send_ack"] = summarize(bench_websocket(websocket_messages))
+        except ImportError as e:
+            stages["websocket_send_ack"] = {"skipped": str(e)}
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"source": source, "frames": frames, "synthetic": synthetic, "roi_size": roi_size,
+                   "websocket_messages": websocket_messages},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "numpy": np.__version__, "opencv": cv2.__version__},
+        "stages": stages,
+        "decision_latency": bench_decision_latency(landmarks, timestamps, labels, threshold_store),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-stage and end-to-end latency of the attention pipeline")
+    parser.add_argument("--source", default=None, help="Video file, image directory or landmark dump for the decode/FaceMesh stages")
+    parser.add_argument("--frames", type=int, default=300, help="Maximum number of frames to read from --source")
+    parser.add_argument("--synthetic", type=int, default=3000, help="Length of the synthetic landmark stream")
+    parser.add_argument("--thresholds", default=THRESHOLDS_FILE, help="Thresholds JSON file")
+    parser.add_argument("--roi-size", type=int, default=None, help="Benchmark FaceMesh on a face crop of this size")
+    parser.add_argument("--websocket-messages", type=int, default=200, help="Messages for the send+ack stage, 0 to skip")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.source, args.frames, args.synthetic, args.thresholds, args.roi_size, args.websocket_messages)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        json.dump(results, sys.stdout, indent=4)
+        print()
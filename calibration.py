@@ -0,0 +1,162 @@
+import time
+import cv2
+import numpy as np
+from helpers import RATIO_NAMES, check_thresholds, get_ratio_array
+from threshold_store import save_thresholds, THRESHOLDS_FILE
+from frame_sources import open_source
+from attention_engine import LandmarkDetector
+from typing import Dict, List, Optional, Union
+
+####### CALIBRATION STEPS ######################################################################################################################################################
+
+# (instruction, threshold set by the step, ratio columns measured in the step)
+CALIBRATION_STEPS = (
+    # Eye calibration
+    ("Keep your head centered and look LEFT with your eyes", "EYE_HORIZONTAL_LEFT", ("LEFT_EYE_HORIZONTAL", "RIGHT_EYE_HORIZONTAL")),
+    ("Keep your head centered and look RIGHT with your eyes", "EYE_HORIZONTAL_RIGHT", ("LEFT_EYE_HORIZONTAL", "RIGHT_EYE_HORIZONTAL")),
+    ("Keep your head centered and look UP with your eyes", "EYE_VERTICAL_UP", ("LEFT_EYE_VERTICAL", "RIGHT_EYE_VERTICAL")),
+    ("Keep your head centered and look DOWN with your eyes", "EYE_VERTICAL_DOWN", ("LEFT_EYE_VERTICAL", "RIGHT_EYE_VERTICAL")),
+    # Face calibration
+    ("Keep your eyes on screen and turn your head LEFT", "FACE_HORIZONTAL_LEFT", ("FACE_HORIZONTAL",)),
+    ("Keep your eyes on screen and turn your head RIGHT", "FACE_HORIZONTAL_RIGHT", ("FACE_HORIZONTAL",)),
+    ("Keep your eyes on screen and tilt your head UP", "FACE_VERTICAL_UP", ("FACE_VERTICAL",)),
+    ("Keep your eyes on screen and tilt your head DOWN", "FACE_VERTICAL_DOWN", ("FACE_VERTICAL",)),
+)
+
+####### ROBUST STATISTICS ######################################################################################################################################################
+
+def trimmed_mean(values: np.ndarray, proportion: float = 0.1, axis: int = 0) -> np.ndarray:
+    """Mean after cutting proportion of the values off each end, which ignores blinks and FaceMesh glitches"""
+    values = np.sort(np.asarray(values, dtype=np.float64), axis=axis)
+    count = values.shape[axis]
+    cut = min(int(count * proportion), (count - 1) // 2)
+    return np.take(values, np.arange(cut, count - cut), axis=axis).mean(axis=axis)
+
+
+def compute_thresholds(step_ratios: List[np.ndarray], trim: float = 0.1) -> Dict[str, float]:
+    """
+    Thresholds from the (samples, 6) ratio arrays captured for each of CALIBRATION_STEPS.
+    Every ratio column gets a trimmed mean over the hold window. Where a step measures both eyes the larger
+    of the two is used, like the original per-capture averaging did.
+    Raises ValueError when a Left/Up threshold does not end up below its Right/Down threshold.
+    """
+    thresholds = {}
+    for (_, name, columns), ratios in zip(CALIBRATION_STEPS, step_ratios):
+        if len(ratios) == 0:
+            raise ValueError(f"No face detected while calibrating {name}")
+        centres = trimmed_mean(ratios, trim)
+        thresholds[name] = round(float(max(centres[RATIO_NAMES.index(column)] for column in columns)), 2)
+    try:
+        check_thresholds(thresholds)
+    except ValueError as e:
+        # E.g. the user looked the wrong way in one of the steps
+        raise ValueError(f"Calibration gave unusable thresholds, please calibrate again: {e}") from e
+    return thresholds
+
+####### STREAMING CAPTURE ######################################################################################################################################################
+
+def drain_buffer(source, max_frames: int = 5, wait: float = 0.01):
+    """
+    Throw away frames the camera buffered while nobody was reading. A grab that has to wait for the
+    sensor means the buffer is empty. Recorded sources have no stale frames and are left alone.
+    """
+    if not source.live:
+        return
+    for _ in range(max_frames):
+        start = time.perf_counter()
+        if not source.grab() or time.perf_counter() - start > wait:
+            return
+
+
+def capture_step(source, detector, instruction: str, hold_time: float = 2.0,
+                 show: bool = True) -> Optional[np.ndarray]:
+    """
+    Wait for SPACE (right away when show is False), then run FaceMesh on every frame for hold_time seconds
+    of source time. Returns the (samples, 6) ratio array, or None when the user pressed ESC or the source ended.
+    """
+    capturing = not show
+    window_end = None
+    ratio_rows = []
+    while True:
+        ret, frame = source.read()
+        if not ret:
+            return None
+        if not source.yields_landmarks:
+            frame = cv2.flip(frame, 1)
+
+        if capturing:
+            landmark_array = frame if source.yields_landmarks else detector.process(frame)
+            if landmark_array is not None:
+                ratio_rows.append(get_ratio_array(landmark_array))
+            if window_end is None:
+                window_end = source.timestamp + hold_time
+            elif source.timestamp >= window_end:
+                return np.array(ratio_rows, dtype=np.float32).reshape(-1, len(RATIO_NAMES))
+
+        if show:
+            # Display instruction and status
+            status_frame = frame.copy()
+            cv2.putText(status_frame, instruction, (20, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            cv2.putText(status_frame, f"Samples: {len(ratio_rows)}",
+                        (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            if capturing:
+                cv2.putText(status_frame, "CAPTURING... hold still", (20, 90),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+            else:
+                cv2.putText(status_frame, "Press SPACE when ready", (20, 90),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
+            cv2.imshow('Calibration', status_frame)
+
+            key = cv2.waitKey(1)
+            if key == 27:  # ESC to exit
+                return None
+            if key == 32 and not capturing:  # SPACE to start capturing
+                capturing = True
+                # Frames buffered while the user was getting into position would pollute the window
+                drain_buffer(source)
+
+####### CALIBRATION ############################################################################################################################################################
+
+def calibrate_thresholds(landmark_indices: Dict[str, int], source: Union[int, str] = 0, hold_time: float = 2.0,
+                         trim: float = 0.1, show: bool = True, path: str = THRESHOLDS_FILE) -> Optional[Dict[str, float]]:
+    """
+    Calibrate eye and face movement thresholds through user interaction.
+    source is a camera index or any other frame source accepted by frame_sources.open_source.
+    Every frame of each hold window goes through FaceMesh, and the thresholds are trimmed means of
+    all of them. With show False no window is opened and each step captures right away.
+    Saves and returns a dictionary of calculated thresholds, or None when cancelled.
+    """
+    cap = open_source(source)
+    detector = None if cap.yields_landmarks else LandmarkDetector(landmark_indices)
+    step_ratios = []
+    try:
+        if show:
+            print("\nCalibration Process Starting...")
+            print("For each step:")
+            print("1. Follow the instruction on screen")
+            print("2. Press SPACE when ready to capture")
+            print(f"3. Hold position for {hold_time:g} seconds while every frame is measured")
+            print("Press any key to begin...")
+            cv2.waitKey(0)
+
+        for instruction, name, _ in CALIBRATION_STEPS:
+            ratios = capture_step(cap, detector, instruction, hold_time, show)
+            if ratios is None:
+                return None
+            print(f"{name}: {len(ratios)} samples")
+            step_ratios.append(ratios)
+    finally:
+        cap.release()
+        if detector is not None:
+            detector.close()
+        if show:
+            cv2.destroyAllWindows()
+
+    thresholds = compute_thresholds(step_ratios, trim)
+
+    # Save thresholds to JSON file
+    save_thresholds(thresholds, path)
+
+    print(f"\nCalibration complete! Thresholds saved to '{path}'")
+    return thresholds
@@ -0,0 +1,126 @@
+import time
+import asyncio
+import websockets
+from metrics import Metrics, NULL_METRICS
+from attention_engine import Decision
+from protocol import SUBPROTOCOL, ACK, VIDEO, encode_state, decode_client
+from typing import Callable, Optional
+
+####### MESSAGE DELIVERY #######################################################################################################################################################
+
+class MessageDelivery:
+    """
+    Delivers play/pause decisions to one client without ever blocking the caller.
+    A reader task consumes everything the client sends and matches acks against the outstanding
+    decision by its sequence number, so pings and stray messages can no longer be mistaken for acks.
+    A sender task sends the newest requested decision and retries it until it is acknowledged.
+    A newer decision replaces one that is still waiting for its ack, so a stale "play" never
+    delays the "pause" that followed it.
+    Clients that negotiated protocol.SUBPROTOCOL get compact version 1 frames, starting with a snapshot,
+    all others get the original bare strings. Their video reports are passed to on_video.
+    """
+    def __init__(self, websocket, metrics: Metrics = NULL_METRICS, ack_timeout: float = 1.0, max_retries: int = 3,
+                 on_video: Optional[Callable[[bool], None]] = None):
+        self.websocket = websocket
+        self.metrics = metrics
+        self.on_video = on_video
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.compact = getattr(websocket, "subprotocol", None) == SUBPROTOCOL
+
+        self.latest = None  # Most recently requested Decision
+        self.outstanding = None  # (Decision, send time) of the decision waiting for its ack
+        self.acknowledged = 0  # Highest acknowledged sequence number
+        self.synced = False  # Whether the client acknowledged a snapshot yet
+        self.new_message = asyncio.Event()
+        self.ack_received = asyncio.Event()
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.ensure_future(self._read()), asyncio.ensure_future(self._send())]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def deliver(self, decision: Decision):
+        """Queue a decision for delivery, replacing any older decision that has not been acknowledged yet"""
+        if self.latest is not None and self.latest.sequence > self.acknowledged:
+            self.metrics.increment("messages_coalesced")
+        self.latest = decision
+        self.new_message.set()
+
+    def _encode(self, decision: Decision) -> str:
+        if not self.compact:
+            return decision.message
+        return encode_state(decision.message, decision.sequence, decision.timestamp, snapshot=not self.synced)
+
+    def _acked_sequence(self, data) -> Optional[int]:
+        """Sequence number acknowledged by a client message, None if it is not an ack"""
+        if self.compact:
+            kind, frame = decode_client(data)
+            if kind == VIDEO and self.on_video is not None:
+                self.on_video(frame["on"])
+            return frame["q"] if kind == ACK else None
+        if self.outstanding is not None and data == f"ack_{self.outstanding[0].message}":
+            return self.outstanding[0].sequence
+        return None
+
+    async def _read(self):
+        """Consume everything the client sends and resolve acks"""
+        try:
+            async for data in self.websocket:
+                sequence = self._acked_sequence(data)
+                # Pings, late acks of replaced decisions and anything unknown need no answer
+                if sequence is None or self.outstanding is None or sequence < self.outstanding[0].sequence:
+                    continue
+                decision, sent_at = self.outstanding
+                self.metrics.observe("ack_rtt", time.monotonic() - sent_at)
+                self.acknowledged = decision.sequence
+                self.synced = True
+                self.outstanding = None
+                self.ack_received.set()
+                print(f"Received acknowledgment for {decision.message}")
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _send(self):
+        """Send the newest decision and retry it until it is acknowledged or replaced"""
+        while True:
+            await self.new_message.wait()
+            self.new_message.clear()
+            decision = self.latest
+            if decision.sequence <= self.acknowledged:
+                continue
+            # Time the decision spent waiting for this connection
+            self.metrics.observe("emit_latency", time.monotonic() - decision.decided_at)
+            message = decision.message
+
+            for attempt in range(self.max_retries):
+                if attempt:
+                    self.metrics.increment("send_retries")
+                self.ack_received.clear()
+                try:
+                    await self.websocket.send(self._encode(decision))
+                except websockets.ConnectionClosed:
+                    return
+                self.outstanding = (decision, time.monotonic())
+                self.metrics.increment("messages_sent")
+                print(f"Sent: {message}")
+
+                # Wait for the ack or a newer decision, whichever comes first
+                waiters = [asyncio.ensure_future(self.ack_received.wait()), asyncio.ensure_future(self.new_message.wait())]
+                await asyncio.wait(waiters, timeout=self.ack_timeout, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in waiters:
+                    waiter.cancel()
+
+                if self.acknowledged >= decision.sequence:
+                    print(f"Successfully sent and acknowledged: {message}")
+                    break
+                if self.new_message.is_set():
+                    print(f"Replaced before acknowledgment: {message}")
+                    break
+            else:
+                self.metrics.increment("send_failures")
+                print(f"Failed to send or get acknowledgment for: {message}")
@@ -3,46 +3,97 @@ let reconnectInterval = 5000;  // Initial reconnect delay
 let maxReconnectInterval = 30000;  // Max delay of 30 seconds
 let isConnected = false;  // Track connection status
 let pingInterval;  // Interval ID for pinging server
+let lastSequence = 0;  // Sequence number of the last state applied to the video
+let lastVideoReport = null;  // Whether the server was last told that there is a video to control
+
+// Wire protocol version 1, see protocol.py on the server
+const SUBPROTOCOL = "attention.v1";
+
+// Tell the server whether the active tab has a video, it releases the camera while there is none
+async function reportVideo() {
+    if (!socket || socket.readyState !== WebSocket.OPEN) {
+        return;
+    }
+    let video = false;
+    try {
+        const tabs = await chrome.tabs.query({ active: true, currentWindow: true });
+        if (tabs.length > 0) {
+            const response = await chrome.tabs.sendMessage(tabs[0].id, { action: "hasVideo" });
+            video = Boolean(response && response.video);
+        }
+    } catch (error) {
+        // No content script in this tab, e.g. a browser page
+    }
+    if (video !== lastVideoReport && socket.readyState === WebSocket.OPEN) {
+        lastVideoReport = video;
+        socket.send(JSON.stringify({ t: "v", on: video }));
+    }
+}
 
 function connectWebSocket() {
-    socket = new WebSocket("ws://localhost:6789");
+    socket = new WebSocket("ws://localhost:6789", SUBPROTOCOL);
 
     socket.onopen = () => {
         console.log("WebSocket connected");
         isConnected = true;
         reconnectInterval = 5000;  // Reset reconnect delay after successful connection
+        lastVideoReport = null;
+        reportVideo();
 
-        // Start pinging every 10 seconds to keep connection alive
+        // Start pinging every 10 seconds to keep connection alive, and catch videos added without a tab event
         pingInterval = setInterval(() => {
             if (socket.readyState === WebSocket.OPEN) {
-                socket.send("ping");
+                socket.send(JSON.stringify({ t: "p" }));
+                reportVideo();
             }
         }, 10000);
     };
 
     socket.onmessage = async (event) => {
-        if (event.data === "pause" || event.data === "play") {
-            console.log("Received message:", event.data);
-            try {
-                // Send message to content script and wait for response
-                const result = await chrome.tabs.query({ active: true, currentWindow: true })
-                    .then(tabs => {
-                        if (tabs.length > 0) {
-                            return chrome.tabs.sendMessage(tabs[0].id, {
-                                action: "controlVideo",
-                                data: event.data
-                            });
-                        }
-                        throw new Error("No active tab found");
-                    });
-                
-                if (result && result.status === "success") {
-                    // Send acknowledgment back to server
-                    socket.send(`ack_${event.data}`);
-                }
-            } catch (error) {
-                console.error("Error controlling video:", error);
+        let frame;
+        try {
+            frame = JSON.parse(event.data);
+        } catch (error) {
+            console.error("Unknown message:", event.data);
+            return;
+        }
+        if (frame.t === "r") {
+            console.log("Attention server ready, camera and model up after", frame.ms, "ms");
+            return;
+        }
+        if (frame.t === "S") {
+            // Snapshot: the server may have restarted, so its sequence numbers start over
+            lastSequence = 0;
+        } else if (frame.t !== "s") {
+            return;
+        }
+        if (frame.q <= lastSequence) {
+            // Resend of a state we already applied, or an older one: only acknowledge
+            socket.send(JSON.stringify({ t: "a", q: lastSequence }));
+            return;
+        }
+
+        console.log("Received message:", frame.s, "#" + frame.q);
+        try {
+            // Send message to content script and wait for response
+            const result = await chrome.tabs.query({ active: true, currentWindow: true })
+                .then(tabs => {
+                    if (tabs.length > 0) {
+                        return chrome.tabs.sendMessage(tabs[0].id, {
+                            action: "controlVideo",
+                            data: frame.s
+                        });
+                    }
+                    throw new Error("No active tab found");
+                });
+
+            if (result && result.status === "success" && frame.q > lastSequence) {
+                // Acknowledge this state and everything before it
+                lastSequence = frame.q;
+                socket.send(JSON.stringify({ t: "a", q: frame.q }));
             }
+        } catch (error) {
+            console.error("Error controlling video:", error);
         }
     };
 
@@ -69,5 +120,14 @@ function connectWebSocket() {
     };
 }
 
+// Re-check for a video whenever another tab or window comes to the front or a page finishes loading
+chrome.tabs.onActivated.addListener(reportVideo);
+chrome.windows.onFocusChanged.addListener(reportVideo);
+chrome.tabs.onUpdated.addListener((tabId, changeInfo) => {
+    if (changeInfo.status === "complete") {
+        reportVideo();
+    }
+});
+
 // Establish the WebSocket connection when the extension is loaded
 connectWebSocket();
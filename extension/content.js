@@ -1,5 +1,20 @@
 // content.js
 
+// Find the video element of the page, if there is one
+function findVideo() {
+    // Try multiple video element selectors
+    const videoSelectors = [
+        'video',
+        'video[src]',
+        'video[style*="display: block"]',
+        '.html5-main-video',
+        '.video-stream'
+    ];
+
+    return videoSelectors.map(selector =>
+        document.querySelector(selector)).find(v => v);
+}
+
 // Function to control video, called when a message is received
 function controlVideo(action) {
     return new Promise((resolve, reject) => {
@@ -7,17 +22,7 @@ function controlVideo(action) {
         let attempts = 0;
         
         const tryControl = () => {
-            // Try multiple video element selectors
-            const videoSelectors = [
-                'video',
-                'video[src]',
-                'video[style*="display: block"]',
-                '.html5-main-video',
-                '.video-stream'
-            ];
-            
-            const video = videoSelectors.map(selector => 
-                document.querySelector(selector)).find(v => v);
+            const video = findVideo();
             
             if (video) {
                 try {
@@ -70,4 +75,7 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
             .catch(error => sendResponse({status: "error", message: error.toString()}));
         return true; // Required for async response
     }
+    if (request.action === "hasVideo") {
+        sendResponse({video: Boolean(findVideo())});
+    }
 });
@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+from helpers import LANDMARK_INDICES, LANDMARK_NAMES, get_index_array
+from frame_sources import LandmarkSource, VideoFileSource
+from attention_engine import FACE_MESH_OPTIONS
+from typing import Dict, List, Optional, Tuple
+
+CACHE_DIR = '.landmark_cache'
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v')
+
+####### CACHE KEYS #############################################################################################################################################################
+# An entry is keyed by the content digest of the video and a digest of everything that changes the extracted
+# landmarks: the FaceMesh options and version, the landmark selection and the number of faces.
+
+def feature_settings(landmark_indices: Optional[Dict[str, int]] = None, max_faces: int = 1, full_mesh: bool = False) -> Dict:
+    """Settings of an extraction; full_mesh keeps all (478, 3) mesh points instead of the 13 (x, y) landmarks"""
+    # Imported here so looking up entries does not load mediapipe
+    from importlib import metadata
+    try:
+        version = metadata.version("mediapipe")
+    except metadata.PackageNotFoundError:
+        version = None
+    return {
+        "face_mesh": dict(FACE_MESH_OPTIONS),
+        "mediapipe": version,
+        "landmarks": None if full_mesh else list(get_index_array(landmark_indices or LANDMARK_INDICES)),
+        "max_faces": max_faces,
+    }
+
+
+def settings_key(settings: Dict) -> str:
+    return hashlib.blake2b(json.dumps(settings, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_videos(paths: List[str]) -> List[str]:
+    """Expand directories into the video files they contain"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(VIDEO_EXTENSIONS)))
+        else:
+            found.append(path)
+    return found
+
+####### EXTRACTION #############################################################################################################################################################
+
+def extract_landmarks(path: str, settings: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Run FaceMesh over every full frame of a video through LandmarkDetector.detect, with the FaceMesh options
+    of the live engine but without its face crop, keyframe tracking or presence gate.
+    Returns landmarks in the frame_sources.LandmarkSource layout, (N, 13, 2) or (N, 478, 3) with a faces axis
+    after N when max_faces is above 1 and NaN where there is no face, and the (N,) timestamps in seconds.
+    """
+    # Imported here so the parent process does not load mediapipe
+    from attention_engine import LandmarkDetector
+    full_mesh = settings["landmarks"] is None
+    max_faces = settings["max_faces"]
+    landmark_indices = LANDMARK_INDICES if full_mesh else dict(zip(LANDMARK_NAMES, settings["landmarks"]))
+    source = VideoFileSource(path)
+    if not source.isOpened():
+        raise ValueError(f"Could not open video {path}")
+    detector = LandmarkDetector(landmark_indices, max_faces=max_faces, presence_gate=False)
+    shape = (max_faces, 478, 3) if full_mesh else (max_faces, len(LANDMARK_NAMES), 2)
+    rows, timestamps = [], []
+    try:
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                break
+            timestamps.append(source.timestamp)
+            row = np.full(shape, np.nan, dtype=np.float32)
+            if full_mesh:
+                results = detector.face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                for face, landmarks in enumerate(results.multi_face_landmarks or ()):
+                    row[face] = [(point.x, point.y, point.z) for point in landmarks.landmark]
+            else:
+                landmark_array = detector.detect(frame)
+                if landmark_array is not None:
+                    faces = landmark_array if landmark_array.ndim == 3 else landmark_array[None]
+                    row[:len(faces)] = faces
+            rows.append(row)
+    finally:
+        source.release()
+        detector.close()
+    landmarks = np.stack(rows) if rows else np.zeros((0,) + shape, dtype=np.float32)
+    return (landmarks[:, 0] if max_faces == 1 else landmarks), np.array(timestamps, dtype=np.float64)
+
+
+def _extract_entry(path: str, entry: str, settings: Dict) -> Dict:
+    """Worker process: extract one video into the cache entry directory entry"""
+    start = time.perf_counter()
+    landmarks, timestamps = extract_landmarks(path, settings)
+    # Written next to the entry and renamed into place, readers never see a partial entry
+    partial = f"{entry}.{os.getpid()}.tmp"
+    os.makedirs(partial, exist_ok=True)
+    np.save(os.path.join(partial, 'landmarks.npy'), landmarks)
+    np.save(os.path.join(partial, 'timestamps.npy'), timestamps)
+    elapsed = time.perf_counter() - start
+    meta = {"source": os.path.abspath(path), "frames": len(landmarks), "settings": settings,
+            "extract_s": round(elapsed, 3), "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    with open(os.path.join(partial, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+    try:
+        os.rename(partial, entry)
+    except OSError:
+        # Another run extracted the same video meanwhile
+        shutil.rmtree(partial, ignore_errors=True)
+    return meta
+
+####### FEATURE CACHE ##########################################################################################################################################################
+
+class FeatureCache:
+    """
+    Per-frame FaceMesh landmarks of recorded videos, stored once in cache_dir and reused by every later
+    experiment. Each entry is a directory named <content digest>-<settings key> with landmarks.npy,
+    timestamps.npy and meta.json. Entries are loaded memory mapped, nothing is copied or decoded.
+    Content digests are remembered in index.json by path, size and modification time, so unchanged videos
+    are not read again; a video whose content changed gets a new entry.
+    """
+    def __init__(self, cache_dir: str = CACHE_DIR, settings: Optional[Dict] = None):
+        self.cache_dir = cache_dir
+        self.settings = settings or feature_settings()
+        self.key = settings_key(self.settings)
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.index = {}  # Absolute path -> [size, mtime_ns, digest]
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def digest(self, path: str) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self.index.get(path)
+        if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = file_digest(path)
+        self.index[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def entry(self, path: str) -> str:
+        return os.path.join(self.cache_dir, f"{self.digest(path)}-{self.key}")
+
+    def contains(self, path: str) -> bool:
+        return os.path.isdir(self.entry(path))
+
+    def load(self, path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Memory mapped (landmarks, timestamps) of a video, None if it has not been extracted"""
+        entry = self.entry(path)
+        if not os.path.isdir(entry):
+            return None
+        return (np.load(os.path.join(entry, 'landmarks.npy'), mmap_mode='r'),
+                np.load(os.path.join(entry, 'timestamps.npy'), mmap_mode='r'))
+
+    def source(self, path: str) -> Optional[LandmarkSource]:
+        """A LandmarkSource over the cached landmarks of a video, None if it has not been extracted"""
+        features = self.load(path)
+        if features is None:
+            return None
+        landmarks, timestamps = features
+        return LandmarkSource(landmarks, timestamps=timestamps)
+
+    def save_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def extract(self, paths: List[str], workers: Optional[int] = None) -> List[Dict]:
+        """
+        Extract every video not in the cache yet, one video per worker process.
+        Returns one report per path: the path, whether it was "cached", "extracted" or "failed", and its frame
+        count. A video that cannot be read or extracted is reported with its error and does not stop the others.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        reports = {}
+        missing = {}
+        for path in paths:
+            try:
+                entry = self.entry(path)
+            except OSError as e:
+                reports[path] = {"path": path, "status": "failed", "frames": 0, "error": str(e)}
+                continue
+            if os.path.isdir(entry):
+                with open(os.path.join(entry, 'meta.json')) as f:
+                    reports[path] = {"path": path, "status": "cached", "frames": json.load(f)["frames"]}
+            else:
+                # The same video under two names is extracted once
+                missing.setdefault(entry, []).append(path)
+        self.save_index()
+
+        if missing:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(min(workers or os.cpu_count() or 1, len(missing)), mp_context=context) as executor:
+                # Largest first, so one long video does not start last and hold up the whole run
+                order = sorted(missing, key=lambda entry: -os.path.getsize(missing[entry][0]))
+                futures = {executor.submit(_extract_entry, missing[entry][0], entry, self.settings): missing[entry]
+                           for entry in order}
+                for future in as_completed(futures):
+                    try:
+                        meta = future.result()
+                    except Exception as e:
+                        for path in futures[future]:
+                            reports[path] = {"path": path, "status": "failed", "frames": 0, "error": str(e)}
+                        continue
+                    for path in futures[future]:
+                        reports[path] = {"path": path, "status": "extracted", "frames": meta["frames"],
+                                         "extract_s": meta["extract_s"]}
+        return [reports[path] for path in paths]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract FaceMesh landmarks of recorded videos into a persistent cache")
+    parser.add_argument("videos", nargs="+", help="Video files or directories of them")
+    parser.add_argument("--cache", default=CACHE_DIR, help="Cache directory")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, default one per core")
+    parser.add_argument("--max-faces", type=int, default=1, help="Extract up to this many faces per frame")
+    parser.add_argument("--full-mesh", action="store_true", help="Keep all 478 mesh points instead of the 13 landmarks")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    cache = FeatureCache(args.cache, feature_settings(max_faces=args.max_faces, full_mesh=args.full_mesh))
+    reports = cache.extract(find_videos(args.videos), args.workers)
+    for report in reports:
+        print(json.dumps(report))
+    print(json.dumps({
+        "videos": len(reports),
+        "extracted": sum(report["status"] == "extracted" for report in reports),
+        "failed": sum(report["status"] == "failed" for report in reports),
+        "frames": sum(report["frames"] for report in reports),
+        "wall_time": round(time.perf_counter() - start_time, 3),
+    }), file=sys.stderr)
+    if any(report["status"] == "failed" for report in reports):
+        sys.exit(1)
@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from helpers import DIRECTION_NAMES, check_thresholds, get_threshold_array, get_ratio_array, get_direction_array, get_attention_array
+from threshold_store import save_thresholds, THRESHOLDS_FILE
+from frame_sources import LandmarkSource
+from calibration import CALIBRATION_STEPS
+from typing import Dict, List, Optional, Tuple
+
+THRESHOLD_NAMES = tuple(name for _, name, _ in CALIBRATION_STEPS)
+DECIMALS = 3  # Precision of the thresholds file
+# Index into THRESHOLD_NAMES of every entry of a (2, 6) threshold array
+_THRESHOLD_LAYOUT = get_threshold_array({name: i for i, name in enumerate(THRESHOLD_NAMES)}).astype(np.intp)
+
+####### LABELLED RECORDINGS ####################################################################################################################################################
+# A labelled recording is an .npz landmark dump as read by frame_sources.LandmarkSource with an extra
+# "labels" array holding 1 for every frame where the viewer was watching and 0 where they were not.
+
+def load_recording(path: str, landmark_indices: Optional[Dict[str, int]] = None) -> Tuple[np.ndarray, np.ndarray, int, int]:
+    """
+    Ratios and labels of the frames with a face, plus the number of faceless frames and how many of
+    them are labelled as not watching. The pipeline pauses on those whatever the thresholds are.
+    """
+    landmarks = LandmarkSource(path, landmark_indices=landmark_indices).landmarks
+    with np.load(path) as data:
+        labels = data["labels"].astype(bool)
+    if landmarks.ndim != 3:
+        raise ValueError(f"{path}: fitting needs single-face recordings, got landmarks of shape {landmarks.shape}")
+    if len(labels) != len(landmarks):
+        raise ValueError(f"{path}: {len(labels)} labels for {len(landmarks)} frames")
+
+    face = ~np.isnan(landmarks).any(axis=(1, 2))
+    ratios = get_ratio_array(np.asarray(landmarks[face], dtype=np.float32))
+    return ratios, labels[face], int((~face).sum()), int((~labels[~face]).sum())
+
+
+def find_recordings(paths: List[str]) -> List[str]:
+    """Expand directories into the .npz files they contain"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith('.npz')))
+        else:
+            found.append(path)
+    return found
+
+####### THRESHOLD FITTING ######################################################################################################################################################
+
+def thresholds_to_vector(thresholds: Dict[str, float]) -> np.ndarray:
+    return np.array([thresholds[name] for name in THRESHOLD_NAMES], dtype=np.float32)
+
+
+def vector_to_thresholds(vector: np.ndarray, decimals: int = DECIMALS) -> Dict[str, float]:
+    return {name: round(float(value), decimals) for name, value in zip(THRESHOLD_NAMES, vector)}
+
+
+def _direction_layout():
+    # (direction column, Left/Up threshold, Right/Down threshold, ratio columns) for every direction
+    layout = []
+    for direction, name in enumerate(DIRECTION_NAMES):
+        low, high = [index for index, threshold in enumerate(THRESHOLD_NAMES) if threshold.rsplit('_', 1)[0] == name]
+        columns = np.flatnonzero(_THRESHOLD_LAYOUT[0] == low)
+        layout.append((direction, low, high, columns))
+    return tuple(layout)
+
+_DIRECTION_LAYOUT = _direction_layout()
+
+
+class ThresholdFitter:
+    """
+    Searches the eight thresholds for the highest weighted share of frames where get_attention agrees with
+    the label. The search is coordinate ascent over the four directions: the Left/Up and Right/Down thresholds
+    of one direction are set together to the best pair of grid_size ratio quantiles while the others stay.
+    All grid_size ** 2 pairs are scored exactly at once: with the other directions fixed every frame has only
+    three possible outcomes, so the frames are binned into a 2D histogram by where their ratios fall in the
+    two grids and cumulative sums give the score of every pair. No Python code runs per frame or per pair.
+    Frames are split into chunks that are binned in a thread pool. With balanced set, both labels count
+    equally however rare one of them is.
+    """
+    def __init__(self, ratios: np.ndarray, labels: np.ndarray, absent: int = 0, absent_correct: int = 0,
+                 balanced: bool = False, grid_size: int = 256, chunk_size: int = 65536, workers: Optional[int] = None):
+        self.ratios = ratios
+        self.labels = labels
+        self.grid_size = grid_size
+        self.workers = workers or os.cpu_count() or 1
+
+        weights = np.ones(len(labels), dtype=np.float64)
+        total = float(len(labels) + absent)
+        absent_weight = float(absent_correct)
+        if balanced:
+            # Faceless frames are always predicted as not watching, they only add to that class
+            watching = max(int(labels.sum()), 1)
+            away = max(len(labels) - int(labels.sum()) + absent, 1)
+            weights = np.where(labels, 0.5 / watching, 0.5 / away)
+            total = 1.0
+            absent_weight = absent_correct * 0.5 / away
+        self.weights = weights
+        self.total = total
+        self.absent_weight = absent_weight
+        self.chunks = [slice(start, start + chunk_size) for start in range(0, len(labels), chunk_size)]
+
+    def _map(self, function, executor: Optional[ThreadPoolExecutor]):
+        return map(function, self.chunks) if executor is None else executor.map(function, self.chunks)
+
+    def score(self, vector: np.ndarray, executor: Optional[ThreadPoolExecutor] = None) -> float:
+        """Accuracy of a threshold vector in THRESHOLD_NAMES order"""
+        threshold_array = vector[_THRESHOLD_LAYOUT]
+
+        def score_chunk(chunk):
+            hits = get_attention_array(get_direction_array(self.ratios[chunk], threshold_array)) == self.labels[chunk]
+            return hits @ self.weights[chunk]
+
+        return float((sum(self._map(score_chunk, executor)) + self.absent_weight) / self.total)
+
+    def grid(self, columns: np.ndarray) -> np.ndarray:
+        """
+        Candidate thresholds for the given ratio columns, quantiles of their values rounded to DECIMALS.
+        Values that differ in the file already differ here, so rounding cannot break Left/Up < Right/Down.
+        """
+        quantiles = np.quantile(self.ratios[:, columns], np.linspace(0.0, 1.0, self.grid_size))
+        return np.unique(np.round(quantiles, DECIMALS).astype(np.float32))
+
+    def pair_scores(self, vector: np.ndarray, direction: int, columns: np.ndarray, low_grid: np.ndarray,
+                    high_grid: np.ndarray, executor: Optional[ThreadPoolExecutor] = None) -> np.ndarray:
+        """
+        (len(high_grid), len(low_grid)) accuracies of vector with the thresholds of one direction replaced
+        by every pair of grid values.
+        """
+        threshold_array = vector[_THRESHOLD_LAYOUT]
+        shape = (len(high_grid) + 1, len(low_grid) + 1)
+
+        def histogram_chunk(chunk):
+            ratios = self.ratios[chunk]
+            directions = get_direction_array(ratios, threshold_array)
+            # Row: how many high_grid values lie below the largest ratio, i.e. for which the direction is Right/Down.
+            # Column: how many low_grid values lie at or below the smallest ratio, i.e. for which it is not Left/Up.
+            bins = (np.searchsorted(high_grid, ratios[:, columns].max(axis=1), 'left') * shape[1]
+                    + np.searchsorted(low_grid, ratios[:, columns].min(axis=1), 'right'))
+            histograms = []
+            for value in (-1, 0, 1):
+                directions[:, direction] = value
+                hits = (get_attention_array(directions) == self.labels[chunk]) * self.weights[chunk]
+                histograms.append(np.bincount(bins, hits, shape[0] * shape[1]).reshape(shape))
+            return np.stack(histograms)
+
+        low, centre, high = sum(self._map(histogram_chunk, executor))
+        # Pair (i, j) calls a frame Right/Down when its row is above j, otherwise Left/Up when its column is at most i
+        high_part = high.sum(axis=1)[::-1].cumsum()[::-1][1:, None]
+        low_part = low.cumsum(axis=0).cumsum(axis=1)[:-1, :-1]
+        centre_rows = centre.cumsum(axis=0)[:-1]
+        centre_part = centre_rows.sum(axis=1, keepdims=True) - centre_rows.cumsum(axis=1)[:, :-1]
+        return (high_part + low_part + centre_part + self.absent_weight) / self.total
+
+    def random_start(self, grids: List[np.ndarray], rng: np.random.Generator) -> np.ndarray:
+        """Random threshold vector with every Left/Up below its Right/Down, drawn from the grids"""
+        vector = np.zeros(len(THRESHOLD_NAMES), dtype=np.float32)
+        for (_, low, high, _), grid in zip(_DIRECTION_LAYOUT, grids):
+            vector[low], vector[high] = np.sort(rng.choice(grid, 2, replace=False))
+        return vector
+
+    def climb(self, start: np.ndarray, grids: List[np.ndarray], max_sweeps: int = 10,
+              executor: Optional[ThreadPoolExecutor] = None) -> Tuple[np.ndarray, float]:
+        """Coordinate ascent from start until a sweep over all directions brings no improvement"""
+        best = start.astype(np.float32).copy()
+        best_score = self.score(best, executor)
+        for _ in range(max_sweeps):
+            improved = False
+            for (direction, low, high, columns), grid in zip(_DIRECTION_LAYOUT, grids):
+                scores = self.pair_scores(best, direction, columns, grid, grid, executor)
+                # Left/Up has to stay below Right/Down
+                scores[grid[:, None] <= grid[None, :]] = -np.inf
+                # Of equally good pairs take the one closest to the current thresholds
+                rows, cols = np.nonzero(scores == scores.max())
+                choice = np.argmin(np.abs(grid[rows] - best[high]) + np.abs(grid[cols] - best[low]))
+                if scores[rows[choice], cols[choice]] > best_score + 1e-12:
+                    best[high], best[low] = grid[rows[choice]], grid[cols[choice]]
+                    best_score = float(scores[rows[choice], cols[choice]])
+                    improved = True
+            if not improved:
+                break
+        return best, best_score
+
+    def fit(self, initial: np.ndarray, restarts: int = 8, max_sweeps: int = 10, seed: int = 0) -> Tuple[np.ndarray, float]:
+        """
+        Best threshold vector found climbing from initial and from restarts random starting points, and its
+        accuracy. The directions interact (eyes may compensate for a turned head), so a single climb can stop
+        at a local optimum.
+        """
+        grids = [self.grid(columns) for _, _, _, columns in _DIRECTION_LAYOUT]
+        rng = np.random.default_rng(seed)
+        best, best_score = None, -1.0
+        with ThreadPoolExecutor(self.workers) as executor:
+            for attempt in range(restarts + 1):
+                start = initial if attempt == 0 else self.random_start(grids, rng)
+                vector, score = self.climb(start, grids, max_sweeps, executor)
+                print(f"Start {attempt}: accuracy {score:.4f}")
+                if score > best_score:
+                    best, best_score = vector, score
+        return best, best_score
+
+
+def load_dataset(paths: List[str], landmark_indices: Optional[Dict[str, int]] = None,
+                 workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, int, int]:
+    """Load and concatenate labelled recordings in parallel"""
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        recordings = list(executor.map(lambda path: load_recording(path, landmark_indices), paths))
+    ratios = np.concatenate([recording[0] for recording in recordings])
+    labels = np.concatenate([recording[1] for recording in recordings])
+    return ratios, labels, sum(recording[2] for recording in recordings), sum(recording[3] for recording in recordings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit attention thresholds to labelled landmark recordings")
+    parser.add_argument("recordings", nargs="+", help=".npz landmark dumps with a 'labels' array, or directories of them")
+    parser.add_argument("--initial", default=THRESHOLDS_FILE, help="Thresholds JSON file to start the search from")
+    parser.add_argument("--output", default=THRESHOLDS_FILE, help="Thresholds JSON file to write")
+    parser.add_argument("--balanced", action="store_true", help="Weigh watching and not watching frames equally")
+    parser.add_argument("--grid-size", type=int, default=256, help="Candidate values of every threshold, all pairs are tried")
+    parser.add_argument("--restarts", type=int, default=8, help="Random starting points tried besides --initial")
+    parser.add_argument("--workers", type=int, default=None, help="Threads used for loading and scoring, default one per core")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    with open(args.initial) as f:
+        initial_thresholds = json.load(f)
+    # Pairs the search cannot improve keep their initial values, so those are checked before any work is done
+    check_thresholds(initial_thresholds)
+    ratios, labels, absent, absent_correct = load_dataset(find_recordings(args.recordings), workers=args.workers)
+    fitter = ThresholdFitter(ratios, labels, absent, absent_correct, args.balanced, args.grid_size, workers=args.workers)
+    initial = thresholds_to_vector(initial_thresholds)
+    initial_score = fitter.score(initial)
+    fitted, _ = fitter.fit(initial, args.restarts)
+    thresholds = vector_to_thresholds(fitted)
+    # Score what is written, after rounding
+    fitted_score = fitter.score(thresholds_to_vector(thresholds))
+    save_thresholds(thresholds, args.output)
+    print(json.dumps({
+        "frames": len(labels) + absent,
+        "faceless_frames": absent,
+        "initial_accuracy": round(initial_score, 4),
+        "fitted_accuracy": round(fitted_score, 4),
+        "wall_time": round(time.perf_counter() - start_time, 3),
+        "thresholds": thresholds,
+    }), file=sys.stderr)
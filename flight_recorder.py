@@ -0,0 +1,273 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+from http import HTTPStatus
+import numpy as np
+from helpers import LANDMARK_NAMES, RATIO_NAMES, DIRECTION_NAMES, get_direction_array, get_attention_score_array
+from typing import Dict, Optional, Tuple
+
+MAGIC = b"ATTNFR01"
+VERSION = 1
+
+# Bits of the flags column
+FLAG_TRACKED = 1  # Landmarks came from the optical flow tracker, not FaceMesh
+FLAG_GATED = 2  # FaceMesh was skipped by the presence gate
+FLAG_RESTARTED = 4  # First sample of a fresh score, after startup or an idle period
+
+# One row per sampled frame. Only the first face of a multi-face sample is kept, faces tells how many there were
+RECORD_DTYPE = np.dtype([
+    ("sample", np.int64),  # Running sample number, also tells a written row from a torn one
+    ("timestamp", np.float64),  # Source timestamp in seconds, see frame_sources
+    ("wall", np.float64),  # Wall clock time, to find the moment a user complains about
+    ("landmarks", np.float32, (len(LANDMARK_NAMES), 2)),  # NaN without a face
+    ("ratios", np.float32, (len(RATIO_NAMES),)),  # NaN without a face
+    ("directions", np.int8, (len(DIRECTION_NAMES),)),  # -1 Left/Up, 0 Center, 1 Right/Down, filled in when read
+    ("thresholds", np.float32, (2, len(RATIO_NAMES))),  # Threshold array the sample was scored with
+    ("faces", np.uint8),
+    ("flags", np.uint8),
+    ("score", np.float64),  # Attention score of the sample
+    ("smoothed", np.float64),  # Smoothed score after the sample
+    ("attention", np.bool_),  # Attention state after the sample
+    ("reported", np.bool_),  # Whether the sample published a play/pause decision
+], align=True)
+
+HEADER_DTYPE = np.dtype({
+    "names": ["magic", "version", "record_size", "capacity", "count",
+              "attention_threshold", "smoothing", "idle_interval", "low", "high"],
+    "formats": ["S8", "<u4", "<u4", "<i8", "<i8", "<f8", "<f8", "<f8", "<f8", "<f8"],
+    "itemsize": 128,
+})
+
+# Decider settings kept in the header, so a replay runs with what was live
+SETTINGS = ("attention_threshold", "smoothing", "idle_interval", "low", "high")
+
+####### FLIGHT RECORDER ########################################################################################################################################################
+
+def _open_ring(path: str, size: int) -> np.memmap:
+    # An existing ring of the right size is kept, so a restart after a crash does not wipe what led up to it
+    mode = "r+" if os.path.exists(path) and os.path.getsize(path) == size else "w+"
+    return np.memmap(path, np.uint8, mode, shape=(size,))
+
+
+def _chronological(records: np.ndarray, first: int, end: int) -> np.ndarray:
+    """
+    Rows of samples first to end - 1 from a ring, oldest first, without rows overwritten meanwhile.
+    Directions follow from the recorded ratios and thresholds and are computed here for all rows at once.
+    """
+    samples = np.arange(first, end)
+    rows = records[samples % len(records)]
+    rows = rows[rows["sample"] == samples]
+    # NaN ratios of samples without a face compare False and come out Center
+    rows["directions"] = get_direction_array(rows["ratios"], rows["thresholds"].transpose(1, 0, 2))
+    return rows
+
+
+class FlightRecorder:
+    """
+    Always-on record of the last capacity samples: timestamps, the 13 landmarks, ratios, directions,
+    thresholds, scores and decisions, in one fixed-size ring of RECORD_DTYPE rows. Everything is
+    allocated up front; record() writes one row in place and costs a few microseconds.
+    With a path, the ring lives in a memory mapped file that survives a crash of the process and is
+    picked up again on the next start. Without one it is kept in memory.
+    record() is called by one thread at a time, the engine or the decision thread; snapshot() and dump()
+    may run concurrently from any thread and leave out rows overwritten while they copy.
+    """
+    def __init__(self, path: Optional[str] = None, capacity: int = 18000):
+        size = HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize
+        self.path = path
+        self.capacity = capacity
+        self.buffer = np.zeros(size, np.uint8) if path is None else _open_ring(path, size)
+        self.header = self.buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        self.records = self.buffer[HEADER_DTYPE.itemsize:].view(RECORD_DTYPE)
+        if self.header["magic"][0] != MAGIC or self.header["version"][0] != VERSION:
+            self.header[0] = (MAGIC, VERSION, RECORD_DTYPE.itemsize, capacity, 0) + (0.0,) * len(SETTINGS)
+        self.count = int(self.header["count"][0])
+        # Field views are taken once, writing a row then only indexes into them
+        self.columns = {name: self.records[name] for name in RECORD_DTYPE.names}
+
+    def configure(self, decider):
+        """Store the settings of the AttentionDecider whose samples are recorded"""
+        values = (decider.scheduler.fast_interval, decider.smoothing, decider.scheduler.idle_interval,
+                  decider.low, decider.high)
+        for name, value in zip(SETTINGS, values):
+            self.header[name] = value
+
+    def record(self, timestamp: float, landmark_array: Optional[np.ndarray], ratio_array: Optional[np.ndarray],
+               threshold_array: np.ndarray, sample: float, decider, reported: bool, tracked: bool = False,
+               gated: bool = False):
+        """Write one sample, after decider.update() has taken it, with the ratio array it was scored from"""
+        columns = self.columns
+        row = self.count % self.capacity
+        columns["sample"][row] = self.count
+        columns["timestamp"][row] = timestamp
+        columns["wall"][row] = time.time()
+        if landmark_array is None:
+            columns["landmarks"][row] = np.nan
+            columns["ratios"][row] = np.nan
+            columns["faces"][row] = 0
+        elif landmark_array.ndim == 2:
+            np.copyto(columns["landmarks"][row], landmark_array)
+            np.copyto(columns["ratios"][row], ratio_array)
+            columns["faces"][row] = 1
+        else:
+            np.copyto(columns["landmarks"][row], landmark_array[0])
+            np.copyto(columns["ratios"][row], ratio_array[0])
+            columns["faces"][row] = len(landmark_array)
+        np.copyto(columns["thresholds"][row], threshold_array)
+        columns["flags"][row] = (FLAG_TRACKED * tracked) | (FLAG_GATED * gated) | (FLAG_RESTARTED * decider.restarted)
+        columns["score"][row] = sample
+        columns["smoothed"][row] = decider.score
+        columns["attention"][row] = decider.attention
+        columns["reported"][row] = reported
+        # Counted only once the row is complete
+        self.count += 1
+        self.header["count"] = self.count
+
+    def snapshot(self) -> np.ndarray:
+        """Copy of the recorded rows, oldest first"""
+        end = self.count
+        records = self.records.copy()
+        # Rows written during the copy replaced the oldest ones
+        return _chronological(records, max(0, self.count - self.capacity), end)
+
+    def settings(self) -> Dict[str, float]:
+        return {name: float(self.header[name][0]) for name in SETTINGS}
+
+    def dump(self, file):
+        """Write the recorded rows to an .npz file (a path or a binary file object), see save_records"""
+        save_records(file, self.snapshot(), self.settings())
+
+    def flush(self):
+        if isinstance(self.buffer, np.memmap):
+            self.buffer.flush()
+
+####### DUMPS ##################################################################################################################################################################
+
+def save_records(file, records: np.ndarray, settings: Dict[str, float]):
+    """
+    One array per RECORD_DTYPE field plus the decider settings. Timestamps are stored as "timestamps",
+    so the dump is also a landmark dump that frame_sources.LandmarkSource and replay.py can read.
+    """
+    columns = {("timestamps" if name == "timestamp" else name): records[name] for name in RECORD_DTYPE.names}
+    np.savez(file, **columns, **{name: np.float64(value) for name, value in settings.items()})
+
+
+def load_records(path: str) -> Tuple[np.ndarray, Dict[str, float]]:
+    """Rows (oldest first) and decider settings from an .npz dump or a ring file written by FlightRecorder"""
+    if path.lower().endswith('.npz'):
+        with np.load(path) as data:
+            records = np.zeros(len(data["sample"]), RECORD_DTYPE)
+            for name in RECORD_DTYPE.names:
+                records[name] = data["timestamps" if name == "timestamp" else name]
+            return records, {name: float(data[name]) for name in SETTINGS}
+
+    buffer = np.memmap(path, np.uint8, "r")
+    header = buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+    if header["magic"] != MAGIC or header["version"] != VERSION or header["record_size"] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} is not a flight recorder file")
+    records = buffer[HEADER_DTYPE.itemsize:].view(RECORD_DTYPE)
+    count = int(header["count"])
+    return _chronological(records, max(0, count - len(records)), count), {name: float(header[name]) for name in SETTINGS}
+
+
+def flight_http_handler(recorder: FlightRecorder, path: str = "/flight"):
+    """websockets process_request hook serving a dump of recorder on plain HTTP GET requests to path"""
+    def process_request(request_path, request_headers):
+        if request_path.split("?")[0] != path:
+            return None
+        file = io.BytesIO()
+        recorder.dump(file)
+        body = file.getvalue()
+        filename = time.strftime("flight-%Y%m%d-%H%M%S.npz")
+        return HTTPStatus.OK, [("Content-Type", "application/octet-stream"), ("Content-Length", str(len(body))),
+                               ("Content-Disposition", f'attachment; filename="{filename}"')], body
+    return process_request
+
+####### OFFLINE REPLAY #########################################################################################################################################################
+
+def rescore(records: np.ndarray, threshold_array: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Attention scores of the recorded ratios, under threshold_array or else the thresholds each sample was
+    scored with. Multi-face samples keep their recorded (combined) score, only their first face is recorded.
+    """
+    scores = records["score"].copy()
+    single = records["faces"] == 1
+    scores[records["faces"] == 0] = 0.0
+    if threshold_array is not None:
+        scores[single] = get_attention_score_array(records["ratios"][single], threshold_array)
+        return scores
+    # Batched once per distinct threshold array, there are as many as calibrations during the recording
+    thresholds, groups = np.unique(records["thresholds"][single], axis=0, return_inverse=True)
+    indices = np.flatnonzero(single)
+    groups = groups.reshape(-1)
+    for group, group_thresholds in enumerate(thresholds):
+        members = indices[groups == group]
+        scores[members] = get_attention_score_array(records["ratios"][members], group_thresholds)
+    return scores
+
+
+def replay_records(records: np.ndarray, settings: Dict[str, float], scores: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Run recorded samples through the AttentionDecider again and return the (attention, reported) arrays.
+    The decider starts from the state recorded after the first row; scores replaces the recorded scores,
+    e.g. rescore() under different thresholds.
+    """
+    # Imported here so attention_engine can import this module
+    from attention_engine import AttentionDecider
+    decider = AttentionDecider(settings["attention_threshold"], settings["smoothing"], settings["idle_interval"],
+                               (settings["low"], settings["high"]))
+    scores = records["score"] if scores is None else scores
+    attention = records["attention"].copy()
+    reported = records["reported"].copy()
+    if len(records) == 0:
+        return attention, reported
+    decider.score = float(records["smoothed"][0])
+    decider.attention = bool(records["attention"][0])
+    decider.last_time = float(records["timestamp"][0])
+    for i in range(1, len(records)):
+        if records["flags"][i] & FLAG_RESTARTED:
+            decider.reset()
+        reported[i] = decider.update(float(records["timestamp"][i]), float(scores[i])) is not None
+        attention[i] = decider.attention
+    return attention, reported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a flight recorder file or dump through the decision logic")
+    parser.add_argument("source", help="Flight recorder ring file or .npz dump")
+    parser.add_argument("--thresholds", default=None, help="Rescore with this thresholds JSON file instead of the recorded thresholds")
+    parser.add_argument("--dump", default=None, help="Write the recorded rows to this .npz file")
+    parser.add_argument("--output", default=None, help="Write replayed decisions to this file instead of stdout")
+    args = parser.parse_args()
+
+    records, settings = load_records(args.source)
+    if args.dump:
+        save_records(args.dump, records, settings)
+    threshold_array = None
+    if args.thresholds:
+        from threshold_store import ThresholdStore
+        threshold_array = ThresholdStore(args.thresholds).get_array()
+    attention, reported = replay_records(records, settings, rescore(records, threshold_array))
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for record, state, report in zip(records, attention, reported):
+            if report:
+                output.write(json.dumps({"time": round(float(record["timestamp"]), 3),
+                                         "wall": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record["wall"])),
+                                         "message": "play" if state else "pause",
+                                         "recorded": bool(record["reported"])}) + "\n")
+    finally:
+        if args.output:
+            output.close()
+    summary = {
+        "records": len(records),
+        "span_s": round(float(records["timestamp"][-1] - records["timestamp"][0]), 3) if len(records) else 0.0,
+        "recorded_decisions": int(records["reported"].sum()),
+        "replayed_decisions": int(reported.sum()),
+        "mismatched_states": int((attention != records["attention"]).sum()),
+    }
+    print(json.dumps(summary), file=sys.stderr)
@@ -0,0 +1,327 @@
+import os
+import time
+import threading
+import cv2
+import numpy as np
+from helpers import LANDMARK_INDICES, LANDMARK_NAMES, get_index_array, gather_landmarks
+from typing import Dict, NamedTuple, Optional, Union
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+LANDMARK_EXTENSIONS = ('.npy', '.npz')
+
+####### FRAME SOURCES ##########################################################################################################################################################
+# Every source follows the cv2.VideoCapture grab()/retrieve()/read()/isOpened()/release() protocol,
+# so the pipeline can skip frames without decoding them. After each grab(), timestamp holds the time of
+# the grabbed frame in seconds and frame_count the number of frames grabbed so far.
+# Sources with yields_landmarks = True return (13, 2) landmark arrays (or None for "no face") instead of images.
+# warm_up() waits until the source can deliver frames; recorded sources do not lose a frame to it.
+# live is True for sources that keep producing frames whether or not they are read, i.e. cameras.
+
+class CameraSource:
+    """Live webcam. Timestamps are monotonic clock readings taken when a frame is grabbed"""
+    yields_landmarks = False
+    live = True
+    dropped = 0  # Frames the camera delivered that were never grabbed, only counted by LatestFrameCamera
+
+    def __init__(self, index: int = 0):
+        self.cap = cv2.VideoCapture(index)
+        self.timestamp = 0.0
+        self.frame_count = 0
+
+    def isOpened(self) -> bool:
+        return self.cap.isOpened()
+
+    def warm_up(self):
+        # The first grab of a webcam blocks until the sensor delivers, get it over with before sampling starts
+        self.cap.grab()
+
+    def grab(self) -> bool:
+        ok = self.cap.grab()
+        if ok:
+            self.timestamp = time.monotonic()
+            self.frame_count += 1
+        return ok
+
+    def retrieve(self):
+        return self.cap.retrieve()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        self.cap.release()
+
+
+class CaptureSettings(NamedTuple):
+    """Requested camera mode, None keeps the driver default. Drivers fall back to the nearest mode they support"""
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    fourcc: Optional[str] = None  # Pixel format, e.g. "MJPG" or "YUYV"
+
+    def apply(self, cap: cv2.VideoCapture):
+        # The pixel format has to be set first, it limits the resolutions and frame rates on offer
+        if self.fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        if self.width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.fps:
+            cap.set(cv2.CAP_PROP_FPS, self.fps)
+        # Keep as few frames as the driver allows queued up, they only age in there
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def describe(self, cap: cv2.VideoCapture) -> str:
+        """The mode the driver actually picked"""
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        return (f"{int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))} "
+                f"@ {cap.get(cv2.CAP_PROP_FPS):g} fps, {''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4))}")
+
+
+class LatestFrameCamera(CameraSource):
+    """
+    Live webcam read by a background thread, so the pipeline always gets the newest frame.
+    When inference is slower than the camera, cv2.VideoCapture hands out frames that waited in its buffer
+    for hundreds of milliseconds. Here the grabber thread grabs every frame as soon as it arrives, without
+    decoding it; grab() waits for a frame newer than the last one it returned, and frames nobody asked for
+    in between are dropped and counted in dropped.
+    Only retrieve() decodes, on demand and always the newest grabbed frame. That can be a frame or two newer
+    than the one grab() returned; timestamp and dropped are then updated to it. Frames are decoded into one
+    preallocated buffer, which is not written to again before the next retrieve().
+    Timestamps are monotonic clock readings taken when the grabber received the frame.
+    """
+    def __init__(self, index: int = 0, settings: Optional[CaptureSettings] = None, timeout: float = 2.0):
+        super().__init__(index)
+        self.settings = settings or CaptureSettings()
+        self.settings.apply(self.cap)
+        self.timeout = timeout  # Seconds grab() waits for a frame before giving up on the camera
+        self.buffer = None  # Allocated by the first retrieve() and reused from then on
+        self.condition = threading.Condition()
+        # cv2.VideoCapture is not thread safe, the grabber thread and retrieve() take turns on it
+        self.capture_lock = threading.Lock()
+        self.retrieving = False  # Holds the grabber back so retrieve() gets the capture lock right away
+        self.latest_time = 0.0
+        self.captured = 0  # Frames grabbed by the grabber thread
+        self.consumed = 0  # Value of captured at the last grab() or retrieve()
+        self.dropped = 0
+        self.running = self.cap.isOpened()
+        self.thread = threading.Thread(target=self._capture, daemon=True)
+        if self.running:
+            print(f"Camera {index}: {self.settings.describe(self.cap)}")
+            self.thread.start()
+
+    def _capture(self):
+        """Grabber thread: grab every frame, leaving it to retrieve() to decode the ones that are sampled"""
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.retrieving or not self.running)
+                if not self.running:
+                    break
+            with self.capture_lock:
+                ok = self.cap.grab()
+                captured_at = time.monotonic()
+                with self.condition:
+                    if ok:
+                        self.latest_time = captured_at
+                        self.captured += 1
+                    else:
+                        self.running = False
+                    self.condition.notify_all()
+
+    def isOpened(self) -> bool:
+        return self.running or self.captured > self.consumed
+
+    def warm_up(self):
+        # Wait for the first frame without taking it
+        with self.condition:
+            self.condition.wait_for(lambda: self.captured > 0 or not self.running)
+
+    def grab(self) -> bool:
+        """Wait for a frame newer than the last one grabbed"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.captured > self.consumed or not self.running, self.timeout)
+            if self.captured == self.consumed:
+                # Camera failed or stalled
+                return False
+            self.dropped += self.captured - self.consumed - 1
+            self.consumed = self.captured
+            self.timestamp = self.latest_time
+        self.frame_count += 1
+        return True
+
+    def retrieve(self):
+        """Decode the newest grabbed frame"""
+        with self.condition:
+            self.retrieving = True
+        try:
+            with self.capture_lock:
+                ok, frame = self.cap.retrieve() if self.buffer is None else self.cap.retrieve(self.buffer)
+                with self.condition:
+                    # Frames grabbed since grab() returned were never handed out
+                    self.dropped += self.captured - self.consumed
+                    self.consumed = self.captured
+                    self.timestamp = self.latest_time
+        finally:
+            with self.condition:
+                self.retrieving = False
+                self.condition.notify_all()
+        if ok:
+            self.buffer = frame
+        return ok, frame
+
+    def release(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread.is_alive():
+            self.thread.join(timeout=self.timeout)
+        self.cap.release()
+
+
+class VideoFileSource(CameraSource):
+    """Recorded video file. Timestamps are derived from the frame index and the frame rate of the file"""
+    live = False
+
+    def __init__(self, path: str, fps: float = 30.0):
+        self.cap = cv2.VideoCapture(path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or fps
+        self.timestamp = 0.0
+        self.frame_count = 0
+
+    def warm_up(self):
+        pass
+
+    def grab(self) -> bool:
+        ok = self.cap.grab()
+        if ok:
+            self.timestamp = self.frame_count / self.fps
+            self.frame_count += 1
+        return ok
+
+
+class ImageDirectorySource:
+    """Directory of still images, played back in file name order at a fixed frame rate"""
+    yields_landmarks = False
+    live = False
+
+    def __init__(self, path: str, fps: float = 30.0):
+        self.paths = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(IMAGE_EXTENSIONS))
+        self.fps = fps
+        self.timestamp = 0.0
+        self.frame_count = 0
+        self.opened = True
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def warm_up(self):
+        pass
+
+    def grab(self) -> bool:
+        if not self.opened or self.frame_count >= len(self.paths):
+            return False
+        self.timestamp = self.frame_count / self.fps
+        self.frame_count += 1
+        return True
+
+    def retrieve(self):
+        frame = cv2.imread(self.paths[self.frame_count - 1])
+        return frame is not None, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        self.opened = False
+
+
+class LandmarkSource:
+    """
+    Pre-extracted landmarks, so replays skip FaceMesh entirely.
+    Accepts .npy files holding (N, 478, 2 or 3) full meshes or (N, 13, 2) arrays in helpers.LANDMARK_NAMES order,
+    and .npz files with the same array under "landmarks" plus optional "timestamps" in seconds.
+    An in-memory array (and timestamps) can be passed instead of a path.
+    Frames without a face are rows full of NaN. .npy files are memory mapped, not loaded.
+    Multi-face dumps add a faces axis, e.g. (N, faces, 13, 2), with NaN rows for absent faces, and yield
+    (faces, 13, 2) arrays of the faces present.
+    """
+    yields_landmarks = True
+    live = False
+
+    def __init__(self, landmarks, fps: float = 30.0, landmark_indices: Optional[Dict[str, int]] = None,
+                 timestamps: Optional[np.ndarray] = None):
+        if isinstance(landmarks, str) and landmarks.lower().endswith('.npz'):
+            with np.load(landmarks) as data:
+                timestamps = data["timestamps"] if "timestamps" in data else timestamps
+                landmarks = data["landmarks"]
+        elif isinstance(landmarks, str):
+            landmarks = np.load(landmarks, mmap_mode='r')
+
+        if landmarks.shape[-2] != len(LANDMARK_NAMES):
+            landmarks = gather_landmarks(landmarks, get_index_array(landmark_indices or LANDMARK_INDICES))
+        self.landmarks = landmarks
+        self.timestamps = timestamps
+        self.fps = fps
+        self.timestamp = 0.0
+        self.frame_count = 0
+        self.opened = True
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def warm_up(self):
+        pass
+
+    def grab(self) -> bool:
+        if not self.opened or self.frame_count >= len(self.landmarks):
+            return False
+        if self.timestamps is not None:
+            self.timestamp = float(self.timestamps[self.frame_count])
+        else:
+            self.timestamp = self.frame_count / self.fps
+        self.frame_count += 1
+        return True
+
+    def retrieve(self):
+        landmark_array = np.asarray(self.landmarks[self.frame_count - 1], dtype=np.float32)
+        if landmark_array.ndim == 3:
+            landmark_array = landmark_array[~np.isnan(landmark_array).any(axis=(1, 2))]
+            return True, landmark_array if len(landmark_array) else None
+        if np.isnan(landmark_array).any():
+            return True, None
+        return True, landmark_array
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        self.opened = False
+
+
+def open_source(source: Union[int, str] = 0, fps: float = 30.0, landmark_indices: Optional[Dict[str, int]] = None,
+                capture: Optional[CaptureSettings] = None):
+    """
+    Open a frame source from a camera index, a video file, a directory of images
+    or a .npy/.npz landmark dump. fps is used where the source has no timing of its own.
+    Cameras are opened in the mode given by capture and read through a LatestFrameCamera.
+    """
+    if isinstance(source, int) or str(source).isdigit():
+        return LatestFrameCamera(int(source), capture)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, fps)
+    if yields_landmarks(source):
+        return LandmarkSource(source, fps, landmark_indices)
+    return VideoFileSource(source, fps)
+
+
+def yields_landmarks(source: Union[int, str]) -> bool:
+    """Whether open_source(source) returns landmark arrays rather than images, without opening it"""
+    return isinstance(source, str) and source.lower().endswith(LANDMARK_EXTENSIONS)
@@ -1,3 +1,5 @@
+import numpy as np
+
 def get_landmarks(landmarks, landmark_indices):
     landmarks_dict = {}
     for landmark, index in landmark_indices.items():
@@ -82,4 +84,159 @@ def check_attention_state(attention_history):
     if all(attention_history):
         return True
     elif not any(attention_history):
-        return False
\ No newline at end of file
+        return False
+
+####### VECTORIZED PIPELINE ####################################################################################################################################################
+# Array based versions of the helpers above. Landmarks are kept as float32 normalized coordinates,
+# which gives the same ratios as pixel coordinates (the points of a ratio share one axis) without the
+# integer truncation. Every function also accepts leading batch dimensions, e.g. (N, 13, 2) landmarks.
+
+# FaceMesh indices of the landmarks used for the ratios
+LANDMARK_INDICES = {
+    "LEFT_EYE_OUTER": 33,
+    "LEFT_EYE_INNER": 173,
+    "RIGHT_EYE_OUTER": 263,
+    "RIGHT_EYE_INNER": 398,
+    "LEFT_EYE_TOP": 222,
+    "LEFT_EYE_BOTTOM": 230,
+    "RIGHT_EYE_TOP": 442,
+    "RIGHT_EYE_BOTTOM": 450,
+    "LEFT_PUPIL": 468,
+    "RIGHT_PUPIL": 473,
+    "NOSE": 4,
+    "CHIN": 152,
+    "FOREHEAD": 10
+}
+
+# Row order of landmark arrays
+LANDMARK_NAMES = (
+    "LEFT_EYE_OUTER", "LEFT_EYE_INNER", "RIGHT_EYE_OUTER", "RIGHT_EYE_INNER",
+    "LEFT_EYE_TOP", "LEFT_EYE_BOTTOM", "RIGHT_EYE_TOP", "RIGHT_EYE_BOTTOM",
+    "LEFT_PUPIL", "RIGHT_PUPIL", "NOSE", "CHIN", "FOREHEAD"
+)
+
+# Column order of ratio arrays, with the (p1, p2, p3, axis) passed to calculate_ratio for each
+RATIO_NAMES = (
+    "LEFT_EYE_HORIZONTAL", "LEFT_EYE_VERTICAL", "RIGHT_EYE_HORIZONTAL",
+    "RIGHT_EYE_VERTICAL", "FACE_VERTICAL", "FACE_HORIZONTAL"
+)
+_RATIO_POINTS = (
+    ("LEFT_EYE_OUTER", "LEFT_PUPIL", "LEFT_EYE_INNER", 0),
+    ("LEFT_EYE_TOP", "LEFT_PUPIL", "LEFT_EYE_BOTTOM", 1),
+    ("RIGHT_EYE_INNER", "RIGHT_PUPIL", "RIGHT_EYE_OUTER", 0),
+    ("RIGHT_EYE_TOP", "RIGHT_PUPIL", "RIGHT_EYE_BOTTOM", 1),
+    ("FOREHEAD", "NOSE", "CHIN", 1),
+    ("LEFT_EYE_OUTER", "NOSE", "RIGHT_EYE_OUTER", 0),
+)
+
+# Column order of direction arrays. Directions are encoded as -1 for Left/Up, 0 for Center and 1 for Right/Down
+DIRECTION_NAMES = ("FACE_HORIZONTAL", "FACE_VERTICAL", "EYE_VERTICAL", "EYE_HORIZONTAL")
+_DIRECTION_LABELS = (("Left", "Center", "Right"), ("Up", "Center", "Down"), ("Up", "Center", "Down"), ("Left", "Center", "Right"))
+# (Left/Up threshold, Right/Down threshold, direction) for every ratio column
+_RATIO_THRESHOLDS = (
+    ("EYE_HORIZONTAL_LEFT", "EYE_HORIZONTAL_RIGHT", "EYE_HORIZONTAL"),
+    ("EYE_VERTICAL_UP", "EYE_VERTICAL_DOWN", "EYE_VERTICAL"),
+    ("EYE_HORIZONTAL_LEFT", "EYE_HORIZONTAL_RIGHT", "EYE_HORIZONTAL"),
+    ("EYE_VERTICAL_UP", "EYE_VERTICAL_DOWN", "EYE_VERTICAL"),
+    ("FACE_VERTICAL_UP", "FACE_VERTICAL_DOWN", "FACE_VERTICAL"),
+    ("FACE_HORIZONTAL_LEFT", "FACE_HORIZONTAL_RIGHT", "FACE_HORIZONTAL"),
+)
+
+def _build_ratio_matrix():
+    # (26, 12) matrix turning a flattened landmark array into p1 - p2 (first 6 columns) and p1 - p3 (last 6 columns)
+    matrix = np.zeros((len(LANDMARK_NAMES) * 2, len(RATIO_NAMES) * 2), dtype=np.float32)
+    for column, (p1, p2, p3, axis) in enumerate(_RATIO_POINTS):
+        matrix[LANDMARK_NAMES.index(p1) * 2 + axis, column] += 1
+        matrix[LANDMARK_NAMES.index(p2) * 2 + axis, column] -= 1
+        matrix[LANDMARK_NAMES.index(p1) * 2 + axis, column + len(RATIO_NAMES)] += 1
+        matrix[LANDMARK_NAMES.index(p3) * 2 + axis, column + len(RATIO_NAMES)] -= 1
+    return matrix
+
+def _build_attention_table():
+    # get_attention evaluated once for all 81 direction combinations, indexed by the base 3 direction code
+    table = np.zeros(3 ** len(DIRECTION_NAMES), dtype=bool)
+    for code in range(len(table)):
+        digits = [(code // 3 ** (len(DIRECTION_NAMES) - 1 - i)) % 3 for i in range(len(DIRECTION_NAMES))]
+        table[code] = get_attention({name: _DIRECTION_LABELS[i][digits[i]] for i, name in enumerate(DIRECTION_NAMES)})
+    return table
+
+_RATIO_MATRIX = _build_ratio_matrix()
+# Which direction each ratio column votes for, any vote decides (left and right eye are OR-ed)
+_DIRECTION_GROUPS = np.array([[thresholds[2] == name for name in DIRECTION_NAMES] for thresholds in _RATIO_THRESHOLDS])
+_DIRECTION_CODE_WEIGHTS = np.array([3 ** (len(DIRECTION_NAMES) - 1 - i) for i in range(len(DIRECTION_NAMES))])
+_DIRECTION_CODE_OFFSET = int(_DIRECTION_CODE_WEIGHTS.sum())
+_ATTENTION_TABLE = _build_attention_table()
+# Ratio columns of every direction; directions with a single ratio list it twice
+_DIRECTION_COLUMNS = np.array([([column for column, thresholds in enumerate(_RATIO_THRESHOLDS) if thresholds[2] == name] * 2)[:2]
+                               for name in DIRECTION_NAMES])
+# For every entry of the attention table, the (direction, Left/Center/Right) cells of a flattened (4, 3) probability array
+_ATTENTION_CELLS = np.array([[i * 3 + (code // 3 ** (len(DIRECTION_NAMES) - 1 - i)) % 3 for i in range(len(DIRECTION_NAMES))]
+                             for code in range(len(_ATTENTION_TABLE))])
+_RAMP_SIGNS = np.array([[-1], [1]], dtype=np.float32)
+_ATTENTION_WEIGHTS = _ATTENTION_TABLE.astype(np.float32)
+
+def get_index_array(landmark_indices):
+    # Mesh indices in LANDMARK_NAMES order, compute once and reuse for every frame
+    return tuple(int(landmark_indices[name]) for name in LANDMARK_NAMES)
+
+def get_landmark_array(landmarks, index_array):
+    # (13, 2) float32 normalized coordinates from a MediaPipe face landmark list
+    points = landmarks.landmark
+    return np.array([(points[i].x, points[i].y) for i in index_array], dtype=np.float32)
+
+def gather_landmarks(mesh_points, index_array):
+    # (..., 478, 3) full mesh arrays -> (..., 13, 2) landmark arrays
+    return np.asarray(mesh_points, dtype=np.float32)[..., index_array, :2]
+
+def get_ratio_array(landmark_array):
+    flat = landmark_array.reshape(landmark_array.shape[:-2] + (-1,))
+    distances = np.abs(flat @ _RATIO_MATRIX)
+    near = distances[..., :len(RATIO_NAMES)]
+    far = distances[..., len(RATIO_NAMES):]
+    return np.divide(near, far, out=np.zeros_like(near), where=far != 0)
+
+def get_threshold_array(thresholds):
+    # (2, 6) array with the Left/Up limit of every ratio column in row 0 and the Right/Down limit in row 1
+    return np.array([[thresholds[low] for low, _, _ in _RATIO_THRESHOLDS],
+                     [thresholds[high] for _, high, _ in _RATIO_THRESHOLDS]], dtype=np.float32)
+
+def check_thresholds(thresholds):
+    # Every Left/Up limit has to lie below its Right/Down limit, otherwise the pair cannot tell the directions apart
+    for low, high, _ in dict.fromkeys(_RATIO_THRESHOLDS):
+        if not thresholds[low] < thresholds[high]:
+            raise ValueError(f"{low} ({thresholds[low]}) has to be below {high} ({thresholds[high]})")
+
+def get_direction_array(ratio_array, threshold_array):
+    # Boolean matmul ORs the eyes together; Right/Down wins over Left/Up like in get_directions
+    high = (ratio_array > threshold_array[1]) @ _DIRECTION_GROUPS
+    low = (ratio_array < threshold_array[0]) @ _DIRECTION_GROUPS
+    return high.view(np.int8) - (low > high).view(np.int8)
+
+def get_attention_array(direction_array):
+    return _ATTENTION_TABLE[direction_array @ _DIRECTION_CODE_WEIGHTS + _DIRECTION_CODE_OFFSET]
+
+def get_attention_score_array(ratio_array, threshold_array, softness=0.25):
+    # Continuous attention in [0, 1]. Every threshold is widened into a linear ramp softness band widths wide,
+    # which gives each direction a probability of Left/Up, Center and Right/Down, and the score is the
+    # probability that get_attention is True under those directions. Far from every threshold it equals
+    # get_attention_array, close to one it moves smoothly between 0 and 1.
+    width = softness * (threshold_array[1] - threshold_array[0])
+    ramps = (ratio_array[..., None, :] - threshold_array) * _RAMP_SIGNS
+    if (width > 0).all():
+        ramps = np.minimum(np.maximum(ramps / width + 0.5, 0), 1)
+    else:
+        # An equal or inverted pair has no band to widen, its columns keep the hard step of get_direction_array
+        step = width <= 0
+        ramps = np.where(step, ramps > 0, np.minimum(np.maximum(ramps / np.where(step, 1, width) + 0.5, 0), 1))
+    # Either eye can decide a direction, and Right/Down wins over Left/Up like in get_directions
+    sides = ramps[..., _DIRECTION_COLUMNS].max(axis=-1)
+    p_high = sides[..., 1, :]
+    p_low = (1 - p_high) * sides[..., 0, :]
+    p = np.stack([p_low, 1 - p_high - p_low, p_high], axis=-1).reshape(ratio_array.shape[:-1] + (-1,))
+    return p[..., _ATTENTION_CELLS].prod(axis=-1) @ _ATTENTION_WEIGHTS
+
+def ratios_to_dict(ratio_array):
+    return {name: float(ratio_array[i]) for i, name in enumerate(RATIO_NAMES)}
+
+def directions_to_dict(direction_array):
+    return {name: _DIRECTION_LABELS[i][int(direction_array[i]) + 1] for i, name in enumerate(DIRECTION_NAMES)}
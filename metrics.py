@@ -0,0 +1,152 @@
+import json
+import time
+import bisect
+import threading
+from http import HTTPStatus
+from typing import Callable, Dict, List, Optional
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+
+####### METRICS ################################################################################################################################################################
+
+class Histogram:
+    """Fixed-bucket latency histogram, constant time and memory per observation"""
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        milliseconds = seconds * 1000
+        self.counts[bisect.bisect_left(BUCKETS_MS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        if milliseconds > self.max:
+            self.max = milliseconds
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of observations"""
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3),
+            "p50_ms": round(self.percentile(0.5), 3),
+            "p90_ms": round(self.percentile(0.9), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.max, 3),
+            "buckets": {("+inf" if bound == float('inf') else str(bound)): count
+                        for bound, count in zip(BUCKETS_MS, self.counts)},
+        }
+
+
+class Metrics:
+    """
+    Counters, gauges, event rates and latency histograms shared by the engine thread and the event loop.
+    Every recording method returns immediately when enabled is False, so instrumented code costs next to
+    nothing with metrics turned off.
+    """
+    def __init__(self, enabled: bool = True, start_time: Optional[float] = None):
+        self.enabled = enabled
+        self.start_time = time.monotonic() if start_time is None else start_time  # Monotonic time startup is measured from
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.rates = {}  # name -> (last event time, smoothed interval)
+
+    def increment(self, name: str, amount: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float):
+        if not self.enabled:
+            return
+        self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def tick(self, name: str, now: float, smoothing: float = 0.1):
+        """Record an event for a per-second rate, e.g. one camera frame"""
+        if not self.enabled:
+            return
+        with self._lock:
+            last = self.rates.get(name)
+            if last is None:
+                self.rates[name] = (now, None)
+                return
+            last_time, interval = last
+            elapsed = now - last_time
+            interval = elapsed if interval is None else interval + smoothing * (elapsed - interval)
+            self.rates[name] = (now, interval)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "uptime_s": round(time.monotonic() - self.start_time, 1),
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "rates_per_s": {name: round(1 / interval, 2) if interval else 0.0
+                                for name, (_, interval) in self.rates.items()},
+                "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+            }
+
+    def summary(self) -> str:
+        return summarize(self.snapshot())
+
+
+def summarize(snapshot: Dict) -> str:
+    """One line overview of a Metrics snapshot for the GUI status area, also of one fetched from /metrics"""
+    if not snapshot["enabled"]:
+        return "Metrics disabled"
+    histograms = snapshot["histograms"]
+    counters = snapshot["counters"]
+
+    def p50(name):
+        return f"{histograms[name]['p50_ms']:.0f} ms" if histograms.get(name, {}).get("count") else "-"
+    return (f"FPS {snapshot['rates_per_s'].get('frames', 0.0):.1f} | "
+            f"inference {p50('inference')} | ack RTT {p50('ack_rtt')} | "
+            f"decision {p50('decision_latency')} | retries {counters.get('send_retries', 0)} | "
+            f"skipped {counters.get('frames_skipped', 0)}")
+
+
+def metrics_http_handler(metrics: Metrics, path: str = "/metrics", sessions: Optional[Callable[[], List[Dict]]] = None):
+    """
+    websockets process_request hook serving metrics.snapshot() as JSON on plain HTTP GET requests to path,
+    so the metrics endpoint shares the websocket port. Other requests continue with the websocket handshake.
+    With sessions, its result is added as a "sessions" entry, one snapshot per connected client.
+    """
+    def process_request(request_path, request_headers):
+        if request_path.split("?")[0] != path:
+            return None
+        snapshot = metrics.snapshot()
+        if sessions is not None:
+            snapshot["sessions"] = sessions()
+        body = json.dumps(snapshot, indent=4).encode()
+        return HTTPStatus.OK, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))], body
+    return process_request
+
+
+# Shared disabled instance for code paths that are not instrumented
+NULL_METRICS = Metrics(enabled=False)
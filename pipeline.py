@@ -0,0 +1,152 @@
+import time
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+####### SHARED MEMORY FRAME RING ###############################################################################################################################################
+
+class FrameRing:
+    """
+    slots preallocated frames in one multiprocessing.shared_memory block, written by the capture thread and
+    read in place by the inference workers. free holds the slots no worker is reading, a slot goes back
+    once its result has arrived.
+    """
+    def __init__(self, slots: int, shape: Tuple[int, ...], dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.frames = np.ndarray((slots,) + self.shape, self.dtype, buffer=self.shm.buf)
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def write(self, slot: int, frame: np.ndarray):
+        if frame.shape == self.shape:
+            np.copyto(self.frames[slot], frame)
+        else:
+            # Landmarks are normalized and every ratio is measured along one axis, so scaling changes nothing
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=self.frames[slot])
+
+    def close(self):
+        # The array has to go before the buffer it points into
+        self.frames = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _attach_frames(name: str, shape: Tuple[int, ...], dtype: str):
+    shm = shared_memory.SharedMemory(name=name)
+    count = shm.size // (int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return shm, np.ndarray((count,) + tuple(shape), dtype, buffer=shm.buf)
+
+####### INFERENCE WORKERS ######################################################################################################################################################
+
+def _inference_worker(landmark_indices: Dict[str, int], max_faces: int, tasks, results):
+    """
+    Worker process: run FaceMesh on ring slots and send back the landmark arrays.
+    Tasks are (sequence, slot, ring name, frame shape, dtype), None stops the worker.
+    Results are (sequence, slot, landmark array or None, inference seconds), preceded by one None once
+    the model is warmed up.
+    """
+    # Imported here so the parent can import this module without loading mediapipe
+    from attention_engine import LandmarkDetector
+    detector = LandmarkDetector(landmark_indices, max_faces=max_faces)
+    detector.warm_up()
+    results.put(None)
+    shm, frames, attached = None, None, None
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            sequence, slot, name, shape, dtype = task
+            if name != attached:
+                # The capture side replaced its ring
+                frames = None
+                if shm is not None:
+                    shm.close()
+                shm, frames = _attach_frames(name, shape, dtype)
+                attached = name
+            start = time.perf_counter()
+            landmark_array = detector.detect(frames[slot])
+            results.put((sequence, slot, landmark_array, time.perf_counter() - start))
+    finally:
+        frames = None
+        if shm is not None:
+            shm.close()
+        detector.close()
+
+
+class InferencePool:
+    """
+    FaceMesh in worker processes instead of the engine thread, so inference scales past one core and the GIL.
+    Sampled frames are copied once into a FrameRing and only their slot number travels to a worker; what comes
+    back is the compact (13, 2) landmark array. At most slots frames are in flight, which bounds latency:
+    while every slot is taken, new camera frames are dropped rather than queued.
+    Workers are stateless, so face crops and keyframe tracking are not available in this mode.
+    Workers that give no result for result_timeout seconds while frames are in flight count as hung.
+    """
+    def __init__(self, landmark_indices: Dict[str, int], workers: int = 2, max_faces: int = 1, slots: Optional[int] = None,
+                 start_timeout: float = 120.0, result_timeout: float = 30.0):
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.workers = workers
+        self.slots = slots or workers * 2
+        self.start_timeout = start_timeout
+        self.result_timeout = result_timeout
+        self.ring = None
+        self.processes = [context.Process(target=_inference_worker, args=(dict(landmark_indices), max_faces, self.tasks, self.results),
+                                          daemon=True) for _ in range(workers)]
+        for process in self.processes:
+            process.start()
+
+    def warm_up(self):
+        """Wait until every worker has loaded and warmed up its model"""
+        for _ in self.processes:
+            try:
+                self.results.get(timeout=self.start_timeout)
+            except queue.Empty:
+                self.close()
+                raise RuntimeError("Inference workers did not start")
+
+    def acquire(self, timeout: float) -> Optional[int]:
+        """A free ring slot, or None while every slot is in flight. Always a slot before the ring exists"""
+        if self.ring is None:
+            return 0
+        try:
+            return self.ring.free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def in_flight(self) -> int:
+        return 0 if self.ring is None else self.slots - self.ring.free.qsize()
+
+    def submit(self, sequence: int, slot: int, frame: np.ndarray):
+        if self.ring is None:
+            # Sized by the first frame, all later frames are scaled to it
+            self.ring = FrameRing(self.slots, frame.shape, frame.dtype)
+            self.ring.free.get()
+        self.ring.write(slot, frame)
+        self.tasks.put((sequence, slot, self.ring.shm.name, self.ring.shape, self.ring.dtype.str))
+
+    def alive(self) -> bool:
+        return all(process.is_alive() for process in self.processes)
+
+    def release(self, slot: int):
+        self.ring.free.put(slot)
+
+    def close(self, timeout: float = 1.0):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
@@ -0,0 +1,56 @@
+import json
+from typing import Dict, Optional, Tuple
+
+####### WIRE PROTOCOL ##########################################################################################################################################################
+# Version 1 is negotiated through the websocket subprotocol, clients that do not ask for it get the
+# original bare "play" / "pause" strings and answer with "ack_play" / "ack_pause".
+#
+# Every version 1 frame is a compact JSON object with a one letter type in "t":
+#   server -> client  {"t":"S","q":12,"ts":1700000000123,"s":"play","v":1}   snapshot, first message of a connection
+#                     {"t":"s","q":13,"ts":1700000000456,"s":"pause"}        state change
+#                     {"t":"r","ms":850}                                     camera and model ready, ms after server start
+#   client -> server  {"t":"a","q":13}                                       ack, covers every sequence number up to q
+#                     {"t":"p"}                                              keepalive, never answered
+#                     {"t":"v","on":false}                                   whether the client has a video to control,
+#                                                                            the server idles while no client has one
+# q is the server's decision sequence number, it only grows while the server runs. ts is the server's wall
+# clock time of the decision in milliseconds. Only the newest state is ever sent, so a client that fell
+# behind skips straight to it. A snapshot tells the client to forget the sequence numbers it has seen,
+# e.g. after the server restarted.
+
+PROTOCOL_VERSION = 1
+SUBPROTOCOL = f"attention.v{PROTOCOL_VERSION}"
+
+SNAPSHOT = "S"
+STATE = "s"
+READY = "r"
+ACK = "a"
+PING = "p"
+VIDEO = "v"
+
+
+def encode_state(message: str, sequence: int, timestamp: float, snapshot: bool = False) -> str:
+    """Version 1 frame for a play/pause decision, timestamp is the wall clock time of the decision in seconds"""
+    frame = {"t": SNAPSHOT if snapshot else STATE, "q": sequence, "ts": int(timestamp * 1000), "s": message}
+    if snapshot:
+        frame["v"] = PROTOCOL_VERSION
+    return json.dumps(frame, separators=(',', ':'))
+
+
+def encode_ready(startup: float) -> str:
+    """Version 1 frame telling the client that decisions are on their way, startup in seconds"""
+    return json.dumps({"t": READY, "ms": int(startup * 1000)}, separators=(',', ':'))
+
+
+def decode_client(data) -> Tuple[Optional[str], Dict]:
+    """
+    Parse a version 1 client frame into (type, frame) with a valid integer "q" (0 if absent) and boolean "on"
+    (True if absent). Returns (None, {}) for anything that is not a valid frame.
+    """
+    try:
+        frame = json.loads(data)
+        frame["q"] = int(frame.get("q", 0))
+        frame["on"] = bool(frame.get("on", True))
+        return frame["t"], frame
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None, {}
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Optional
+from helpers import LANDMARK_INDICES
+from threshold_store import ThresholdStore, THRESHOLDS_FILE
+from frame_sources import open_source, yields_landmarks
+from attention_engine import (ATTENTION_POLICIES, AttentionDecider, LandmarkDetector, ViewerTracker, run_attention_loop,
+                              run_pipelined_loop)
+from pipeline import InferencePool
+from feature_cache import FeatureCache, feature_settings
+
+####### OFFLINE REPLAY #########################################################################################################################################################
+
+def replay(source, thresholds_path: str = THRESHOLDS_FILE, fps: float = 30.0, attention_threshold: float = 0.1,
+           smoothing: float = 0.2, idle_interval: float = 0.3, roi_size=None, output=sys.stdout,
+           keyframe_interval=None, max_faces: int = 1, policy: str = "any", workers: int = 0, presence_gate: bool = True,
+           feature_cache: Optional[str] = None):
+    """
+    Run the attention pipeline over a recorded source without a camera or a websocket server.
+    Every play/pause decision is written to output as a JSON line with the source timestamp in seconds.
+    With workers set, FaceMesh runs in that many processes, see attention_engine.run_pipelined_loop. The decisions
+    are the same as without workers.
+    With feature_cache set, a video is replayed from its landmarks in that feature_cache.FeatureCache directory,
+    which are extracted first if the video is not in there yet.
+    Returns a summary dictionary.
+    """
+    if feature_cache and os.path.isfile(source) and not yields_landmarks(source):
+        cache = FeatureCache(feature_cache, feature_settings(max_faces=max_faces))
+        report, = cache.extract([source])
+        if report["status"] == "failed":
+            raise ValueError(f"Could not extract landmarks from {source}: {report['error']}")
+        frame_source = cache.source(source)
+    else:
+        frame_source = open_source(source, fps)
+    if frame_source.yields_landmarks:
+        detector = None
+    elif workers:
+        detector = InferencePool(LANDMARK_INDICES, workers, max_faces)
+        detector.warm_up()
+    else:
+        detector = LandmarkDetector(LANDMARK_INDICES, roi_size, keyframe_interval, max_faces, presence_gate)
+    decider = AttentionDecider(attention_threshold, smoothing, idle_interval)
+    viewers = ViewerTracker(policy)
+    threshold_store = ThresholdStore(thresholds_path)
+    decisions = []
+
+    def on_decision(timestamp, attention, frame):
+        decision = {"time": round(timestamp, 3), "frame": frame,
+                    "message": "play" if attention else "pause"}
+        decisions.append(decision)
+        output.write(json.dumps(decision) + "\n")
+
+    start_time = time.perf_counter()
+    try:
+        run_loop = run_pipelined_loop if isinstance(detector, InferencePool) else run_attention_loop
+        run_loop(frame_source, detector, decider, threshold_store, on_decision, viewers=viewers)
+    finally:
+        frame_source.release()
+        if detector is not None:
+            detector.close()
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "frames": frame_source.frame_count,
+        "samples": decider.sample_count,
+        "decisions": len(decisions),
+        "duration": round(frame_source.timestamp, 3),
+        "wall_time": round(elapsed, 3),
+        "frames_per_second": round(frame_source.frame_count / elapsed, 1) if elapsed > 0 else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded video, images or landmark dumps through the attention pipeline")
+    parser.add_argument("source", help="Video file, directory of images, .npy/.npz landmark dump or camera index")
+    parser.add_argument("--thresholds", default=THRESHOLDS_FILE, help="Thresholds JSON file")
+    parser.add_argument("--fps", type=float, default=30.0, help="Frame rate for sources without timing information")
+    parser.add_argument("--attention-threshold", type=float, default=0.1, help="Seconds between attention decisions")
+    parser.add_argument("--smoothing", type=float, default=0.2, help="Time constant of the attention score average in seconds")
+    parser.add_argument("--idle-interval", type=float, default=0.3, help="Seconds between samples while the state is stable")
+    parser.add_argument("--roi-size", type=int, default=None, help="Run FaceMesh on a face crop of this size")
+    parser.add_argument("--keyframe-interval", type=int, default=None, help="Run FaceMesh on every Nth sample and track landmarks in between")
+    parser.add_argument("--max-faces", type=int, default=1, help="Score up to this many viewers per frame")
+    parser.add_argument("--policy", choices=ATTENTION_POLICIES, default="any", help="How the attention of several viewers is combined")
+    parser.add_argument("--workers", type=int, default=0, help="Run FaceMesh in this many worker processes")
+    parser.add_argument("--no-presence-gate", action="store_true", help="Run FaceMesh on every sample, even while nobody is in view")
+    parser.add_argument("--feature-cache", default=None, help="Replay videos from their landmarks cached in this directory")
+    parser.add_argument("--output", default=None, help="Write decisions to this file instead of stdout")
+    args = parser.parse_args()
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        summary = replay(args.source, args.thresholds, args.fps, args.attention_threshold,
+                         args.smoothing, args.idle_interval, args.roi_size, output, args.keyframe_interval,
+                         args.max_faces, args.policy, args.workers, not args.no_presence_gate, args.feature_cache)
+    finally:
+        if args.output:
+            output.close()
+    print(json.dumps(summary), file=sys.stderr)
@@ -0,0 +1,139 @@
+import time
+# Startup times are measured from here, before the heavy imports below
+PROCESS_START = time.monotonic()
+import sys
+import signal
+import asyncio
+import argparse
+from helpers import LANDMARK_INDICES
+from attention_engine import ATTENTION_POLICIES, AttentionEngine
+from threshold_store import ThresholdStore, THRESHOLDS_FILE
+from frame_sources import CaptureSettings
+from metrics import Metrics, metrics_http_handler
+from flight_recorder import flight_http_handler
+from protocol import SUBPROTOCOL
+from session import SessionRegistry
+from typing import Callable, Optional
+
+####### HEADLESS SERVER ########################################################################################################################################################
+
+class AttentionServer:
+    """
+    The websocket server without any UI: the shared AttentionEngine, one Session per client, and the
+    /metrics endpoint and /flight recorder dump on the same port. With warm set, the camera and model are opened as soon as the
+    server starts instead of on the first connection.
+    run() serves until request_stop() is called; everything happens on one event loop, nothing polls.
+    """
+    def __init__(self, engine: AttentionEngine, host: str = "localhost", port: int = 6789, warm: bool = True):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.warm = warm
+        self.sessions = SessionRegistry(engine)
+        self.server = None
+        self.stop_requested = None
+
+    async def start(self):
+        import websockets
+        self.stop_requested = asyncio.Event()
+        handlers = [metrics_http_handler(self.engine.metrics, sessions=self.sessions.snapshot)]
+        if self.engine.recorder is not None:
+            handlers.append(flight_http_handler(self.engine.recorder))
+
+        def process_request(path, request_headers):
+            for handler in handlers:
+                response = handler(path, request_headers)
+                if response is not None:
+                    return response
+            return None
+        self.server = await websockets.serve(self.sessions.serve, self.host, self.port, process_request=process_request,
+                                             subprotocols=[SUBPROTOCOL])
+        if self.warm:
+            self.engine.start(asyncio.get_running_loop())
+
+    def request_stop(self):
+        """Ask run() to shut down; must be called on the event loop, see stop_threadsafe"""
+        if self.stop_requested is not None:
+            self.stop_requested.set()
+
+    def stop_threadsafe(self, loop: asyncio.AbstractEventLoop):
+        loop.call_soon_threadsafe(self.request_stop)
+
+    async def stop(self):
+        """Close every connection, then release the camera and model"""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        # Joining the engine thread blocks, keep the loop free for its last messages
+        await asyncio.get_running_loop().run_in_executor(None, self.engine.stop)
+
+    async def run(self, on_ready: Optional[Callable[[], None]] = None):
+        await self.start()
+        try:
+            if on_ready is not None:
+                on_ready()
+            await self.stop_requested.wait()
+        finally:
+            await self.stop()
+
+
+def install_signal_handlers(loop: asyncio.AbstractEventLoop, callback: Callable[[], None]):
+    """Call callback on the loop on SIGINT or SIGTERM"""
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, callback)
+        except (NotImplementedError, RuntimeError):
+            # Windows event loops have no add_signal_handler
+            signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(callback))
+
+
+async def main(args: argparse.Namespace):
+    engine = AttentionEngine(dict(LANDMARK_INDICES), ThresholdStore(args.thresholds), source=args.source,
+                             roi_size=args.roi_size, keyframe_interval=args.keyframe_interval,
+                             max_faces=args.max_faces, policy=args.policy, metrics=Metrics(enabled=not args.no_metrics, start_time=PROCESS_START),
+                             capture=CaptureSettings(args.width, args.height, args.fps, args.pixel_format),
+                             workers=args.workers, presence_gate=not args.no_presence_gate, idle_delay=args.idle_delay,
+                             flight_recorder=args.flight_recorder, flight_capacity=args.flight_capacity)
+    server = AttentionServer(engine, args.host, args.port, warm=not args.lazy_camera)
+    install_signal_handlers(asyncio.get_running_loop(), server.request_stop)
+
+    async def report_startup():
+        await engine.ready.wait()
+        print(f"Camera and model ready after {engine.ready_after * 1000:.0f} ms")
+
+    def on_ready():
+        print(f"Serving on ws://{server.host}:{server.port} (metrics on http://{server.host}:{server.port}/metrics), "
+              f"listening after {(time.monotonic() - PROCESS_START) * 1000:.0f} ms")
+        if engine.ready is not None:
+            asyncio.ensure_future(report_startup())
+
+    await server.run(on_ready)
+    print("Server stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the attention websocket server without the GUI")
+    parser.add_argument("--host", default="localhost", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=6789, help="Port for websocket clients and /metrics")
+    parser.add_argument("--source", default="0", help="Camera index, video file, image directory or landmark dump")
+    parser.add_argument("--width", type=int, default=None, help="Camera frame width in pixels")
+    parser.add_argument("--height", type=int, default=None, help="Camera frame height in pixels")
+    parser.add_argument("--fps", type=float, default=None, help="Camera frame rate")
+    parser.add_argument("--pixel-format", default=None, help="Camera pixel format as a FourCC, e.g. MJPG or YUYV")
+    parser.add_argument("--thresholds", default=THRESHOLDS_FILE, help="Thresholds JSON file")
+    parser.add_argument("--roi-size", type=int, default=None, help="Run FaceMesh on a face crop of this size")
+    parser.add_argument("--keyframe-interval", type=int, default=None, help="Run FaceMesh on every Nth sample and track landmarks in between")
+    parser.add_argument("--max-faces", type=int, default=1, help="Score up to this many viewers per frame")
+    parser.add_argument("--policy", choices=ATTENTION_POLICIES, default="any", help="How the attention of several viewers is combined")
+    parser.add_argument("--workers", type=int, default=0, help="Run FaceMesh in this many worker processes")
+    parser.add_argument("--no-presence-gate", action="store_true", help="Run FaceMesh on every sample, even while nobody is in view")
+    parser.add_argument("--idle-delay", type=float, default=2.0, help="Seconds without a client watching a video before the camera is released")
+    parser.add_argument("--flight-recorder", default=None, help="Keep the flight recorder ring in this memory mapped file")
+    parser.add_argument("--flight-capacity", type=int, default=18000, help="Samples kept by the flight recorder, 0 turns it off")
+    parser.add_argument("--lazy-camera", action="store_true", help="Open the camera on the first connection instead of at startup")
+    parser.add_argument("--no-metrics", action="store_true", help="Record no metrics, /metrics then only reports that they are disabled")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -0,0 +1,153 @@
+import time
+import asyncio
+import itertools
+import numpy as np
+import websockets
+from attention_engine import AttentionEngine, Decision
+from delivery import MessageDelivery
+from protocol import encode_ready
+from typing import Dict, List
+
+# Row layout of the per-session decision history ring
+HISTORY_DTYPE = np.dtype([("sequence", np.int64), ("timestamp", np.float64), ("attention", np.bool_)])
+
+_session_ids = itertools.count(1)
+
+####### CLIENT SESSIONS ########################################################################################################################################################
+
+class Session:
+    """
+    Everything the server keeps for one connected client. It is created when the client connects and
+    torn down when it leaves, so concurrent or reconnecting clients never share state.
+    history is a preallocated ring of the last history_size decisions handed to this client, so a session
+    takes the same memory however long it runs. thresholds is the (read-only) threshold mapping that was
+    active for the last decision.
+    """
+    def __init__(self, websocket, engine: AttentionEngine, history_size: int = 32):
+        self.id = next(_session_ids)
+        self.websocket = websocket
+        self.engine = engine
+        self.started = time.monotonic()
+
+        self.history = np.zeros(history_size, dtype=HISTORY_DTYPE)
+        self.history_count = 0  # Decisions recorded so far, the next one goes to history_count % history_size
+        self.attention = None  # Attention state last handed to this client, None before the first decision
+        self.last_sent = None  # Last Decision handed to delivery
+        self.thresholds = engine.threshold_store.get()
+        self.video = True  # Whether the client has a video to control, until it reports otherwise
+
+        self.delivery = MessageDelivery(websocket, engine.metrics, on_video=self.set_video)
+        self.updates = None
+
+    async def __aenter__(self):
+        self.delivery.start()
+        self.updates = self.engine.subscribe()
+        if not self.video:
+            # Reported before the subscription existed
+            self.engine.set_video(self.updates, False)
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+    async def close(self):
+        """Unsubscribe from the engine and stop delivery, safe to call more than once"""
+        if self.updates is not None:
+            self.engine.unsubscribe(self.updates)
+            self.updates = None
+        await self.delivery.close()
+
+    def set_video(self, playing: bool):
+        self.video = playing
+        if self.updates is not None:
+            self.engine.set_video(self.updates, playing)
+
+    def record(self, decision: Decision):
+        if self.history_count == 0:
+            # A warm engine answers a new client with its current state right away
+            self.engine.metrics.observe("connect_to_decision", time.monotonic() - self.started)
+        row = self.history[self.history_count % len(self.history)]
+        row["sequence"] = decision.sequence
+        row["timestamp"] = decision.timestamp
+        row["attention"] = decision.message == "play"
+        self.history_count += 1
+        self.attention = decision.message == "play"
+        self.last_sent = decision
+        self.thresholds = self.engine.threshold_store.get()
+
+    def recent(self) -> np.ndarray:
+        """Recorded decisions, oldest first"""
+        if self.history_count <= len(self.history):
+            return self.history[:self.history_count].copy()
+        return np.roll(self.history, -(self.history_count % len(self.history)))
+
+    def snapshot(self) -> Dict:
+        """State of the session for the /metrics endpoint, with its recent decisions"""
+        return {
+            "id": self.id,
+            "connected_s": round(time.monotonic() - self.started, 1),
+            "attention": self.attention,
+            "last_sent": self.last_sent.message if self.last_sent is not None else None,
+            "decisions": self.history_count,
+            "video": self.video,
+            "thresholds": dict(self.thresholds),
+            "recent": [{"sequence": int(sequence), "timestamp": round(float(timestamp), 3), "attention": bool(attention)}
+                       for sequence, timestamp, attention in self.recent()],
+        }
+
+    async def announce_ready(self):
+        """Tell version 1 clients once the camera and model are ready"""
+        await self.engine.ready.wait()
+        if self.delivery.compact:
+            try:
+                await self.websocket.send(encode_ready(self.engine.ready_after))
+            except websockets.ConnectionClosed:
+                pass
+
+    async def run(self):
+        """Forward the engine's decisions to the client until it disconnects or the camera stream ends"""
+        closed = asyncio.ensure_future(self.websocket.wait_closed())
+        ready = asyncio.ensure_future(self.announce_ready())
+        try:
+            while True:
+                next_update = asyncio.ensure_future(self.updates.get())
+                done, _ = await asyncio.wait({next_update, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if next_update not in done:
+                    # Client went away
+                    next_update.cancel()
+                    break
+
+                decision = next_update.result()
+                if decision is None:
+                    # Camera closed or failed to deliver a frame
+                    break
+                self.record(decision)
+                self.delivery.deliver(decision)
+        finally:
+            closed.cancel()
+            ready.cancel()
+
+
+class SessionRegistry:
+    """The open sessions of a server, keyed by session ID"""
+    def __init__(self, engine: AttentionEngine):
+        self.engine = engine
+        self.sessions = {}
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    async def serve(self, websocket, path=None):
+        """websockets connection handler: one Session per connection, removed again when it ends"""
+        async with Session(websocket, self.engine) as session:
+            self.sessions[session.id] = session
+            self.engine.metrics.set_gauge("sessions", len(self.sessions))
+            try:
+                await session.run()
+            finally:
+                del self.sessions[session.id]
+                self.engine.metrics.set_gauge("sessions", len(self.sessions))
+
+    def snapshot(self) -> List[Dict]:
+        """Snapshots of the connected sessions, served as "sessions" by /metrics"""
+        return [session.snapshot() for session in list(self.sessions.values())]
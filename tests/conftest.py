@@ -0,0 +1,26 @@
+import os
+import sys
+import json
+import numpy as np
+import pytest
+
+# The modules live flat in the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from helpers import LANDMARK_NAMES
+from benchmark import CENTER_POSE
+
+THRESHOLDS_PATH = os.path.join(ROOT, 'attention_thresholds.json')
+
+
+@pytest.fixture
+def thresholds():
+    with open(THRESHOLDS_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def facing():
+    """(13, 2) landmark array of a viewer looking at the screen"""
+    return np.array([CENTER_POSE[name] for name in LANDMARK_NAMES], dtype=np.float32)
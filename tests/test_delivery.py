@@ -0,0 +1,118 @@
+import json
+import time
+import asyncio
+from metrics import Metrics
+from attention_engine import Decision
+from delivery import MessageDelivery
+from protocol import SUBPROTOCOL, SNAPSHOT, STATE
+
+
+class FakeSocket:
+    """Websocket whose client answers every sent frame with answer(frame), if that returns anything"""
+    def __init__(self, subprotocol=None, answer=None):
+        self.subprotocol = subprotocol
+        self.answer = answer
+        self.sent = []
+        self.incoming = asyncio.Queue()
+
+    async def send(self, data):
+        self.sent.append(data)
+        reply = self.answer(data) if self.answer is not None else None
+        if reply is not None:
+            self.incoming.put_nowait(reply)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.incoming.get()
+
+
+def decision(message: str, sequence: int) -> Decision:
+    return Decision(message, time.monotonic(), sequence, time.time())
+
+
+async def until(condition, timeout: float = 1.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.001)
+
+
+def run(scenario):
+    """Run scenario(delivery, websocket, metrics) on a started MessageDelivery"""
+    async def main(websocket, metrics, **options):
+        delivery = MessageDelivery(websocket, metrics, **options)
+        delivery.start()
+        try:
+            await scenario(delivery, websocket, metrics)
+        finally:
+            await delivery.close()
+    return main
+
+
+def test_legacy_client_acks_by_message():
+    @run
+    async def scenario(delivery, websocket, metrics):
+        delivery.deliver(decision("play", 1))
+        await until(lambda: delivery.acknowledged == 1)
+        delivery.deliver(decision("pause", 2))
+        await until(lambda: delivery.acknowledged == 2)
+        assert websocket.sent == ["play", "pause"]
+        assert metrics.counters["messages_sent"] == 2
+        assert metrics.histograms["ack_rtt"].count == 2
+
+    asyncio.run(scenario(FakeSocket(answer=lambda data: f"ack_{data}"), Metrics()))
+
+
+def test_newer_decision_replaces_one_waiting_for_its_ack():
+    @run
+    async def scenario(delivery, websocket, metrics):
+        delivery.deliver(decision("play", 1))
+        await until(lambda: len(websocket.sent) == 1)
+        delivery.deliver(decision("pause", 2))
+        await until(lambda: len(websocket.sent) == 2)
+        frames = [json.loads(data) for data in websocket.sent]
+        # Nothing was acknowledged yet, so the replacement is still a snapshot
+        assert [(frame["t"], frame["q"], frame["s"]) for frame in frames] == [(SNAPSHOT, 1, "play"), (SNAPSHOT, 2, "pause")]
+        assert metrics.counters["messages_coalesced"] == 1
+
+        # A late ack of the replaced decision does not count for the newer one
+        websocket.incoming.put_nowait('{"t":"a","q":1}')
+        await asyncio.sleep(0.02)
+        assert delivery.acknowledged == 0 and delivery.outstanding is not None
+        websocket.incoming.put_nowait('{"t":"a","q":2}')
+        await until(lambda: delivery.acknowledged == 2)
+
+        delivery.deliver(decision("play", 3))
+        await until(lambda: len(websocket.sent) == 3)
+        assert json.loads(websocket.sent[2])["t"] == STATE
+        assert len(websocket.sent) == 3 and "send_retries" not in metrics.counters
+
+    asyncio.run(scenario(FakeSocket(SUBPROTOCOL), Metrics(), ack_timeout=5.0))
+
+
+def test_unacknowledged_decision_is_retried_then_dropped():
+    @run
+    async def scenario(delivery, websocket, metrics):
+        delivery.deliver(decision("pause", 1))
+        await until(lambda: "send_failures" in metrics.counters)
+        assert websocket.sent == ["pause"] * 3
+        assert metrics.counters["send_retries"] == 2
+        assert delivery.acknowledged == 0
+
+    asyncio.run(scenario(FakeSocket(), Metrics(), ack_timeout=0.02, max_retries=3))
+
+
+def test_pings_and_video_reports_need_no_answer():
+    reports = []
+
+    @run
+    async def scenario(delivery, websocket, metrics):
+        for data in ('{"t":"p"}', '{"t":"v","on":false}', "ack_play", '{"t":"v"}'):
+            websocket.incoming.put_nowait(data)
+        await until(lambda: len(reports) == 2)
+        assert reports == [False, True]
+        assert websocket.sent == [] and delivery.acknowledged == 0
+
+    asyncio.run(scenario(FakeSocket(SUBPROTOCOL), Metrics(), on_video=reports.append))
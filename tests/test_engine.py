@@ -0,0 +1,133 @@
+import time
+import asyncio
+import pytest
+import attention_engine
+from helpers import LANDMARK_INDICES
+from threshold_store import ThresholdStore
+from attention_engine import AttentionDecider, AttentionEngine
+from conftest import THRESHOLDS_PATH
+
+IDLE_DELAY = 0.2
+
+
+def feed(decider, samples, start=0.0, step=0.1):
+    """Update decider with one sample every step seconds, returns the reported states by time"""
+    reported = {}
+    for i, sample in enumerate(samples):
+        attention = decider.update(start + i * step, sample)
+        if attention is not None:
+            reported[round(start + i * step, 3)] = attention
+    return reported
+
+
+def test_decider_reports_the_first_sample_and_then_only_flips():
+    decider = AttentionDecider()
+    assert feed(decider, [1.0] * 10) == {0.0: True}
+    assert decider.stable
+    # A single look away moves the average but stays inside the hysteresis band
+    assert feed(decider, [0.0] + [1.0] * 5, start=1.0) == {}
+    flips = feed(decider, [0.0] * 10, start=2.0)
+    assert list(flips.values()) == [False]
+    assert 2.0 < next(iter(flips)) <= 2.3
+    assert decider.flip_latency == pytest.approx(next(iter(flips)) - 2.0)
+
+
+def test_decider_ignores_non_finite_samples():
+    decider = AttentionDecider()
+    feed(decider, [1.0] * 5)
+    score = decider.score
+    assert decider.update(1.0, float("nan")) is None
+    assert decider.score == score and decider.sample_count == 5
+
+
+def test_decider_samples_less_often_once_settled():
+    decider = AttentionDecider(attention_threshold=0.1, idle_interval=0.3)
+    decider.update(0.0, 0.5)
+    assert not decider.stable and not decider.due(0.09) and decider.due(0.1)
+    feed(decider, [1.0] * 10, start=0.1)
+    assert decider.stable and not decider.due(1.2) and decider.due(1.3)
+
+
+def test_decider_reset_reports_the_unchanged_state():
+    decider = AttentionDecider()
+    feed(decider, [1.0] * 10)
+    decider.reset()
+    assert decider.due(0.0)
+    assert decider.update(5.0, 1.0) is True
+    assert decider.update(5.1, 1.0) is None
+
+
+class LiveLandmarks:
+    """Endless live source of one landmark array at about 30 frames per second"""
+    live = True
+    yields_landmarks = True
+    dropped = 0
+
+    def __init__(self, landmark_array):
+        self.landmark_array = landmark_array
+        self.frame_count = 0
+        self.timestamp = 0.0
+        self.released = False
+
+    def warm_up(self):
+        pass
+
+    def isOpened(self) -> bool:
+        return not self.released
+
+    def grab(self) -> bool:
+        time.sleep(1 / 30)
+        self.frame_count += 1
+        self.timestamp = time.monotonic()
+        return True
+
+    def retrieve(self):
+        return True, self.landmark_array
+
+    def release(self):
+        self.released = True
+
+
+@pytest.fixture
+def sources(monkeypatch, facing):
+    """Every source the engine opens, in order"""
+    opened = []
+
+    def open_source(source, capture=None):
+        opened.append(LiveLandmarks(facing))
+        return opened[-1]
+
+    monkeypatch.setattr(attention_engine, "open_source", open_source)
+    return opened
+
+
+def test_engine_idles_and_resumes(sources):
+    async def scenario():
+        engine = AttentionEngine(dict(LANDMARK_INDICES), ThresholdStore(THRESHOLDS_PATH), source="camera.npy",
+                                 idle_delay=IDLE_DELAY, flight_capacity=0)
+        # A warm start nobody subscribes to goes idle once it is ready
+        engine.start(asyncio.get_running_loop())
+        await asyncio.wait_for(engine.ready.wait(), 2.0)
+        await asyncio.sleep(IDLE_DELAY + 0.3)
+        assert engine.metrics.gauges.get("idle") == 1
+        assert [source.released for source in sources] == [True]
+        try:
+            for cycle in range(2):
+                queue = engine.subscribe()
+                decision = await asyncio.wait_for(queue.get(), 2.0)
+                assert decision.message == "play"
+                assert engine.metrics.gauges["idle"] == 0
+                assert len(sources) == cycle + 2 and not sources[-1].released
+
+                # A client without a video counts as gone, like a closed connection
+                engine.set_video(queue, False)
+                await asyncio.sleep(IDLE_DELAY + 0.3)
+                assert engine.metrics.gauges["idle"] == 1
+                assert sources[-1].released
+                engine.unsubscribe(queue)
+        finally:
+            engine.stop()
+        assert not engine.is_running()
+        assert engine.metrics.histograms["resume_to_decision"].count == 2
+
+    asyncio.run(scenario())
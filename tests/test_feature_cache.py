@@ -0,0 +1,103 @@
+import os
+import json
+import cv2
+import numpy as np
+import pytest
+import feature_cache
+from feature_cache import FeatureCache, feature_settings
+
+
+def write_video(path: str, frames: int = 12, brightness: int = 0) -> str:
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30.0, (64, 48))
+    for i in range(frames):
+        writer.write(np.full((48, 64, 3), (brightness + i) % 256, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def put_entry(cache: FeatureCache, path: str, landmarks: np.ndarray):
+    """Store landmarks for path like an extraction would, without running FaceMesh"""
+    entry = cache.entry(path)
+    os.makedirs(entry)
+    np.save(os.path.join(entry, 'landmarks.npy'), landmarks)
+    np.save(os.path.join(entry, 'timestamps.npy'), np.arange(len(landmarks)) / 30.0)
+    with open(os.path.join(entry, 'meta.json'), 'w') as f:
+        json.dump({"frames": len(landmarks)}, f)
+
+
+@pytest.fixture
+def digests(monkeypatch):
+    """Paths whose content was read to compute a digest, in order"""
+    read = []
+    file_digest = feature_cache.file_digest
+
+    def counting_digest(path, *args):
+        read.append(os.path.basename(path))
+        return file_digest(path, *args)
+
+    monkeypatch.setattr(feature_cache, "file_digest", counting_digest)
+    return read
+
+
+def test_unchanged_videos_are_not_read_again(tmp_path, digests, facing):
+    cache_dir = str(tmp_path / "cache")
+    video = write_video(str(tmp_path / "a.avi"))
+    cache = FeatureCache(cache_dir)
+    landmarks = np.repeat(facing[None], 12, axis=0)
+    put_entry(cache, video, landmarks)
+    assert cache.extract([video]) == [{"path": video, "status": "cached", "frames": 12}]
+
+    # A new run finds the digest in the index, and the entry memory mapped
+    cache = FeatureCache(cache_dir)
+    assert cache.contains(video)
+    source = cache.source(video)
+    assert isinstance(cache.load(video)[0], np.memmap)
+    assert np.array_equal(source.landmarks, landmarks)
+    assert digests == ["a.avi"]
+
+    # Changed content is read again and has no entry yet
+    write_video(video, brightness=100)
+    assert not FeatureCache(cache_dir).contains(video)
+    assert digests == ["a.avi", "a.avi"]
+
+
+def test_entries_are_per_content_and_settings(tmp_path, facing):
+    cache_dir = str(tmp_path / "cache")
+    video = write_video(str(tmp_path / "a.avi"))
+    copy = str(tmp_path / "copy.avi")
+    with open(video, 'rb') as source, open(copy, 'wb') as target:
+        target.write(source.read())
+    cache = FeatureCache(cache_dir)
+    put_entry(cache, video, np.repeat(facing[None], 12, axis=0))
+    # The same video under another name shares the entry
+    assert cache.contains(copy)
+    # Other extraction settings do not
+    assert not FeatureCache(cache_dir, feature_settings(max_faces=2)).contains(video)
+    assert not FeatureCache(cache_dir, feature_settings(full_mesh=True)).contains(video)
+
+
+def test_unreadable_videos_are_reported(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache"))
+    missing = str(tmp_path / "missing.avi")
+    report, = cache.extract([missing])
+    assert report["status"] == "failed" and report["frames"] == 0 and "error" in report
+
+
+def test_extract_only_runs_for_new_videos(tmp_path):
+    pytest.importorskip("mediapipe")
+    cache_dir = str(tmp_path / "cache")
+    first = write_video(str(tmp_path / "a.avi"))
+    second = write_video(str(tmp_path / "b.avi"), frames=8, brightness=50)
+    same = str(tmp_path / "same_as_a.avi")
+    os.link(first, same)
+
+    reports = FeatureCache(cache_dir).extract([first, same], workers=2)
+    assert [report["status"] for report in reports] == ["extracted", "extracted"]
+    entries = [name for name in os.listdir(cache_dir) if name != "index.json"]
+    assert len(entries) == 1
+
+    reports = FeatureCache(cache_dir).extract([first, second, same], workers=2)
+    assert [report["status"] for report in reports] == ["cached", "extracted", "cached"]
+    assert [report["frames"] for report in reports] == [12, 8, 12]
+    landmarks, timestamps = FeatureCache(cache_dir).load(second)
+    assert len(landmarks) == len(timestamps) == 8
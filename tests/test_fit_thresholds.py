@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from helpers import check_thresholds
+from fit_thresholds import ThresholdFitter, _DIRECTION_LAYOUT, thresholds_to_vector, vector_to_thresholds
+
+
+@pytest.fixture
+def fitter():
+    rng = np.random.default_rng(0)
+    ratios = rng.uniform(0.1, 0.9, (3000, 6)).astype(np.float32)
+    labels = rng.random(3000) < 0.6
+    # Small chunks so the histograms of several chunks are added up
+    return ThresholdFitter(ratios, labels, absent=40, absent_correct=30, grid_size=12, chunk_size=700)
+
+
+@pytest.mark.parametrize("balanced", [False, True])
+@pytest.mark.parametrize("layout", _DIRECTION_LAYOUT, ids=lambda layout: str(layout[0]))
+def test_pair_scores_match_brute_force(fitter, thresholds, layout, balanced):
+    if balanced:
+        fitter = ThresholdFitter(fitter.ratios, fitter.labels, absent=40, absent_correct=30, balanced=True,
+                                 grid_size=12, chunk_size=700)
+    direction, low, high, columns = layout
+    vector = thresholds_to_vector(thresholds)
+    grid = fitter.grid(columns)
+    scores = fitter.pair_scores(vector, direction, columns, grid, grid)
+    assert scores.shape == (len(grid), len(grid))
+    for row, high_value in enumerate(grid):
+        for column, low_value in enumerate(grid):
+            candidate = vector.copy()
+            candidate[low], candidate[high] = low_value, high_value
+            assert scores[row, column] == pytest.approx(fitter.score(candidate), abs=1e-9)
+
+
+def test_fit_does_not_get_worse(fitter, thresholds):
+    initial = thresholds_to_vector(thresholds)
+    vector, score = fitter.fit(initial, restarts=2, max_sweeps=3)
+    assert score == pytest.approx(fitter.score(vector))
+    assert score >= fitter.score(initial)
+    for _, low, high, _ in _DIRECTION_LAYOUT:
+        assert vector[low] < vector[high]
+
+
+def test_fitted_thresholds_survive_rounding(fitter, thresholds):
+    # Ratios so close together that most of the unrounded grid values would round to the same one
+    rng = np.random.default_rng(1)
+    ratios = rng.uniform(0.5, 0.503, fitter.ratios.shape).astype(np.float32)
+    close = ThresholdFitter(ratios, fitter.labels, grid_size=64)
+    vector, score = close.fit(thresholds_to_vector(thresholds), restarts=4, max_sweeps=3)
+    written = vector_to_thresholds(vector)
+    check_thresholds(written)
+    assert close.score(thresholds_to_vector(written)) == pytest.approx(score)
@@ -0,0 +1,86 @@
+import numpy as np
+from helpers import LANDMARK_NAMES
+from threshold_store import ThresholdStore
+from frame_sources import open_source
+from attention_engine import AttentionDecider, run_attention_loop
+from flight_recorder import (FLAG_RESTARTED, RECORD_DTYPE, FlightRecorder, load_records, replay_records, rescore,
+                             save_records)
+from conftest import THRESHOLDS_PATH
+
+FPS = 30.0
+CAPACITY = 64
+
+
+def record_session(tmp_path, facing, recorder):
+    """Run a 20 second landmark dump of a viewer turning away and leaving through the pipeline into recorder"""
+    turned = facing.copy()
+    turned[LANDMARK_NAMES.index("NOSE"), 0] = 0.68
+    absent = np.full_like(facing, np.nan)
+    segments = [(facing, 4.0), (turned, 3.0), (facing, 5.0), (absent, 2.0), (facing, 6.0)]
+    landmarks = np.concatenate([np.repeat(landmark_array[None], int(seconds * FPS), axis=0)
+                                for landmark_array, seconds in segments])
+    path = str(tmp_path / "session.npz")
+    np.savez(path, landmarks=landmarks, timestamps=np.arange(len(landmarks)) / FPS)
+
+    decider = AttentionDecider()
+    recorder.configure(decider)
+    source = open_source(path, FPS)
+    try:
+        run_attention_loop(source, None, decider, ThresholdStore(THRESHOLDS_PATH), lambda *decision: None,
+                           recorder=recorder)
+    finally:
+        source.release()
+    return decider
+
+
+def assert_records_equal(actual, expected):
+    assert len(actual) == len(expected)
+    for name in RECORD_DTYPE.names:
+        np.testing.assert_array_equal(actual[name], expected[name], err_msg=name)
+
+
+def test_ring_file_and_dump_round_trip(tmp_path, facing):
+    ring_path = str(tmp_path / "flight.ring")
+    recorder = FlightRecorder(ring_path, CAPACITY)
+    decider = record_session(tmp_path, facing, recorder)
+    recorder.flush()
+
+    # Only the newest samples are left once the ring wrapped
+    assert decider.sample_count > CAPACITY
+    records = recorder.snapshot()
+    assert list(records["sample"]) == list(range(decider.sample_count - CAPACITY, decider.sample_count))
+    assert (np.diff(records["timestamp"]) > 0).all()
+    assert records["reported"].any() and (records["faces"] == 0).any()
+
+    ring_records, settings = load_records(ring_path)
+    assert_records_equal(ring_records, records)
+    assert settings == recorder.settings()
+    assert settings["attention_threshold"] == decider.scheduler.fast_interval
+
+    dump_path = str(tmp_path / "flight.npz")
+    recorder.dump(dump_path)
+    dump_records, dump_settings = load_records(dump_path)
+    assert_records_equal(dump_records, records)
+    assert dump_settings == settings
+
+    # The file outlives the process, a new recorder on it carries on counting
+    reopened = FlightRecorder(ring_path, CAPACITY)
+    assert reopened.count == decider.sample_count
+    assert_records_equal(reopened.snapshot(), records)
+
+
+def test_replay_of_a_recording_reproduces_its_decisions(tmp_path, facing):
+    recorder = FlightRecorder(capacity=1000)
+    record_session(tmp_path, facing, recorder)
+    records, settings = recorder.snapshot(), recorder.settings()
+    assert records["flags"][0] & FLAG_RESTARTED
+
+    np.testing.assert_allclose(rescore(records), records["score"])
+    attention, reported = replay_records(records, settings, rescore(records))
+    assert np.array_equal(attention, records["attention"])
+    assert np.array_equal(reported[1:], records["reported"][1:])
+
+    # A dump can be cut down and saved again, e.g. to share the moments around a wrong pause
+    part = records[10:40]
+    save_records(str(tmp_path / "part.npz"), part, settings)
+    assert_records_equal(load_records(str(tmp_path / "part.npz"))[0], part)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from helpers import (LANDMARK_NAMES, RATIO_NAMES, get_ratios, get_directions, get_attention, get_ratio_array,
+                     get_threshold_array, get_direction_array, get_attention_array, get_attention_score_array,
+                     check_thresholds, ratios_to_dict, directions_to_dict)
+
+
+def random_faces(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random((count, len(LANDMARK_NAMES), 2), dtype=np.float32)
+
+
+def test_ratio_array_matches_dict_helpers():
+    for landmark_array in random_faces(200):
+        pixel_coords = {name: tuple(map(float, point)) for name, point in zip(LANDMARK_NAMES, landmark_array)}
+        ratios = get_ratios(pixel_coords)
+        assert np.allclose(get_ratio_array(landmark_array), [ratios[name] for name in RATIO_NAMES], rtol=1e-4, atol=1e-6)
+
+
+def test_ratio_array_matches_dict_helpers_on_degenerate_faces(facing):
+    # Closed eyes and a face seen edge-on put two reference points on top of each other
+    degenerate = facing.copy()
+    for top, bottom in (("LEFT_EYE_TOP", "LEFT_EYE_BOTTOM"), ("RIGHT_EYE_TOP", "RIGHT_EYE_BOTTOM")):
+        degenerate[LANDMARK_NAMES.index(bottom)] = degenerate[LANDMARK_NAMES.index(top)]
+    degenerate[LANDMARK_NAMES.index("RIGHT_EYE_OUTER"), 0] = degenerate[LANDMARK_NAMES.index("LEFT_EYE_OUTER"), 0]
+    pixel_coords = {name: tuple(map(float, point)) for name, point in zip(LANDMARK_NAMES, degenerate)}
+    ratios = get_ratios(pixel_coords)
+    ratio_array = get_ratio_array(degenerate)
+    assert np.isfinite(ratio_array).all()
+    assert np.allclose(ratio_array, [ratios[name] for name in RATIO_NAMES], rtol=1e-4, atol=1e-6)
+    assert ratios["LEFT_EYE_VERTICAL"] == ratios["FACE_HORIZONTAL"] == 0
+
+
+def test_ratio_array_batches_like_single_frames():
+    faces = random_faces(50)
+    assert np.array_equal(get_ratio_array(faces), np.stack([get_ratio_array(face) for face in faces]))
+
+
+def test_directions_and_attention_match_dict_helpers(thresholds):
+    threshold_array = get_threshold_array(thresholds)
+    # Ratios around the thresholds, so every direction takes all three values
+    ratios = np.random.default_rng(1).uniform(0.2, 0.9, (2000, len(RATIO_NAMES))).astype(np.float32)
+    direction_array = get_direction_array(ratios, threshold_array)
+    attention_array = get_attention_array(direction_array)
+    for ratio_array, directions, attention in zip(ratios, direction_array, attention_array):
+        # Thresholds compared at float32 precision like the array version
+        expected = get_directions(ratios_to_dict(ratio_array), {name: float(np.float32(value)) for name, value in thresholds.items()})
+        assert directions_to_dict(directions) == expected
+        assert attention == get_attention(expected)
+    assert 0 < attention_array.sum() < len(attention_array)
+
+
+def test_attention_score_agrees_with_hard_attention_away_from_thresholds(thresholds, facing):
+    threshold_array = get_threshold_array(thresholds)
+    ratio_array = get_ratio_array(facing)
+    assert get_attention_score_array(ratio_array, threshold_array) == pytest.approx(1.0)
+    turned = facing.copy()
+    turned[LANDMARK_NAMES.index("NOSE"), 0] = 0.68  # Head turned far to one side
+    ratio_array = get_ratio_array(turned)
+    assert not get_attention_array(get_direction_array(ratio_array, threshold_array))
+    assert get_attention_score_array(ratio_array, threshold_array) == pytest.approx(0.0)
+
+
+def test_check_thresholds_rejects_inverted_pairs(thresholds):
+    check_thresholds(thresholds)
+    inverted = dict(thresholds, EYE_VERTICAL_UP=thresholds["EYE_VERTICAL_DOWN"])
+    with pytest.raises(ValueError):
+        check_thresholds(inverted)
@@ -0,0 +1,166 @@
+import time
+import queue
+import random
+import threading
+import numpy as np
+import pytest
+from helpers import LANDMARK_NAMES
+from threshold_store import ThresholdStore
+from attention_engine import AttentionDecider, run_attention_loop, run_pipelined_loop
+from pipeline import InferencePool
+from conftest import THRESHOLDS_PATH
+
+FPS = 30.0
+FACING, TURNED, ABSENT = range(3)
+
+
+class ThreadPool(InferencePool):
+    """InferencePool with threads for workers, which finish in random order. Frames hold the code of their landmarks"""
+    def __init__(self, landmarks, workers: int = 3, delay: float = 0.004, answer: bool = True):
+        self.landmarks = landmarks
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.workers = workers
+        self.slots = workers * 2
+        self.result_timeout = 1.0
+        self.ring = None
+        self.processes = []
+        self.delay = delay
+        self.answer = answer
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            sequence, slot = task[:2]
+            code = int(self.ring.frames[slot].flat[0])
+            time.sleep(random.uniform(0, self.delay))
+            if self.answer:
+                self.results.put((sequence, slot, self.landmarks[code], self.delay))
+
+    def alive(self) -> bool:
+        return all(thread.is_alive() for thread in self.threads)
+
+    def close(self, timeout: float = 1.0):
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class CodeSource:
+    """Recorded source of small frames filled with a landmark code, or of the landmarks themselves"""
+    live = False
+    dropped = 0
+
+    def __init__(self, codes, landmarks=None, stop_event=None, stop_at=None):
+        self.codes = codes
+        self.landmarks = landmarks
+        self.yields_landmarks = landmarks is not None
+        self.stop_event = stop_event
+        self.stop_at = stop_at
+        self.frame_count = 0
+        self.timestamp = 0.0
+
+    def isOpened(self) -> bool:
+        return True
+
+    def grab(self) -> bool:
+        if self.frame_count == len(self.codes):
+            return False
+        self.frame_count += 1
+        self.timestamp = (self.frame_count - 1) / FPS
+        if self.frame_count == self.stop_at:
+            self.stop_event.set()
+        return True
+
+    def retrieve(self):
+        code = self.codes[self.frame_count - 1]
+        if self.yields_landmarks:
+            return True, self.landmarks[code]
+        return True, np.full((4, 4, 3), code, dtype=np.uint8)
+
+
+@pytest.fixture
+def landmarks(facing):
+    turned = facing.copy()
+    turned[LANDMARK_NAMES.index("NOSE"), 0] = 0.68
+    return [facing, turned, None]
+
+
+def make_codes(seed: int):
+    """About 40 seconds of watching, turning away and leaving in random stretches"""
+    rng = random.Random(seed)
+    codes = []
+    while len(codes) < 40 * FPS:
+        codes.extend([rng.choice([FACING, FACING, TURNED, ABSENT])] * rng.randint(2, 150))
+    return codes
+
+
+def run_serial(codes, landmarks):
+    decider = AttentionDecider()
+    decisions = []
+    run_attention_loop(CodeSource(codes, landmarks), None, decider, ThresholdStore(THRESHOLDS_PATH),
+                       lambda now, attention, frame: decisions.append((now, attention, frame)))
+    return decisions, decider.sample_count
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_pipelined_decisions_match_serial(landmarks, seed):
+    codes = make_codes(seed)
+    pool = ThreadPool(landmarks)
+    decider = AttentionDecider()
+    decisions = []
+    try:
+        interrupted = run_pipelined_loop(CodeSource(codes), pool, decider, ThresholdStore(THRESHOLDS_PATH),
+                                         lambda now, attention, frame: decisions.append((now, attention, frame)))
+    finally:
+        pool.close()
+    assert not interrupted
+    assert (decisions, decider.sample_count) == run_serial(codes, landmarks)
+    assert len(decisions) > 5
+
+
+def test_interrupt_and_resume_return_every_slot(landmarks):
+    codes = make_codes(0)
+    pool = ThreadPool(landmarks)
+    decider = AttentionDecider()
+    store = ThresholdStore(THRESHOLDS_PATH)
+    stop_event = threading.Event()
+    try:
+        # Stopped on frames that are sampled and on frames that are skipped while holding a slot
+        for stop_at in range(40, 46):
+            stop_event.clear()
+            decider.reset()
+            source = CodeSource(codes, stop_event=stop_event, stop_at=stop_at)
+            assert run_pipelined_loop(source, pool, decider, store, lambda *decision: None, stop_event)
+            assert pool.ring.free.qsize() == pool.slots
+        decider.reset()
+        assert not run_pipelined_loop(CodeSource(codes), pool, decider, store, lambda *decision: None)
+        assert pool.ring.free.qsize() == pool.slots
+    finally:
+        pool.close()
+
+
+@pytest.mark.parametrize("hung", [True, False])
+def test_lost_workers_raise(landmarks, hung):
+    pool = ThreadPool(landmarks, answer=not hung)
+    if not hung:
+        # Ends every worker thread before the first task, like crashed worker processes
+        for _ in pool.threads:
+            pool.tasks.put(None)
+    start = time.monotonic()
+    try:
+        with pytest.raises(RuntimeError):
+            run_pipelined_loop(CodeSource(make_codes(0)), pool, AttentionDecider(), ThresholdStore(THRESHOLDS_PATH),
+                               lambda *decision: None)
+    finally:
+        pool.close()
+    assert time.monotonic() - start < pool.result_timeout + 2.0
@@ -0,0 +1,59 @@
+import json
+import pytest
+from protocol import ACK, PING, READY, VIDEO, SNAPSHOT, STATE, encode_state, encode_ready, decode_client
+
+
+def test_decode_ack():
+    assert decode_client('{"t":"a","q":13}') == (ACK, {"t": "a", "q": 13, "on": True})
+
+
+def test_decode_accepts_bytes():
+    assert decode_client(b'{"t":"p"}')[0] == PING
+
+
+def test_decode_fills_defaults():
+    kind, frame = decode_client('{"t":"p"}')
+    assert kind == PING and frame["q"] == 0 and frame["on"] is True
+
+
+def test_decode_video_report():
+    kind, frame = decode_client('{"t":"v","on":false}')
+    assert kind == VIDEO and frame["on"] is False
+
+
+def test_decode_coerces_numeric_strings():
+    assert decode_client('{"t":"a","q":"7"}')[1]["q"] == 7
+
+
+@pytest.mark.parametrize("data", [
+    "ack_play",  # Legacy client
+    "",
+    "{",
+    "null",
+    "[1, 2]",
+    "42",
+    '{"q":1}',  # No type
+    '{"t":"a","q":"x"}',
+    '{"t":"a","q":null}',
+    '{"t":"a","q":[1]}',
+])
+def test_decode_rejects_invalid_frames(data):
+    assert decode_client(data) == (None, {})
+
+
+def test_encode_state():
+    snapshot = json.loads(encode_state("play", 12, 1700000000.1234, snapshot=True))
+    assert snapshot == {"t": SNAPSHOT, "q": 12, "ts": 1700000000123, "s": "play", "v": 1}
+    state = json.loads(encode_state("pause", 13, 1700000000.5))
+    assert state == {"t": STATE, "q": 13, "ts": 1700000000500, "s": "pause"}
+
+
+def test_encode_ready():
+    assert json.loads(encode_ready(0.8504)) == {"t": READY, "ms": 850}
+
+
+def test_ack_echoes_the_sequence_of_a_state_frame():
+    # What a version 1 client sends back for a frame it received
+    frame = json.loads(encode_state("pause", 2 ** 40, 1700000000.0))
+    ack = json.dumps({"t": ACK, "q": frame["q"]})
+    assert decode_client(ack) == (ACK, {"t": ACK, "q": 2 ** 40, "on": True})
@@ -0,0 +1,50 @@
+import io
+import json
+import numpy as np
+from helpers import LANDMARK_NAMES
+from replay import replay
+from conftest import THRESHOLDS_PATH
+
+FPS = 30.0
+
+
+def make_dump(facing):
+    """30 seconds of landmarks alternating between watching, a turned head and no face, with the change times"""
+    turned = facing.copy()
+    turned[LANDMARK_NAMES.index("NOSE"), 0] = 0.68
+    absent = np.full_like(facing, np.nan)
+    segments = [(facing, 4.0), (turned, 3.0), (facing, 5.0), (absent, 2.0), (facing, 6.0), (turned, 4.0), (facing, 6.0)]
+    frames, changes = [], []
+    for landmark_array, seconds in segments:
+        changes.append(len(frames) / FPS)
+        frames.extend([landmark_array] * int(seconds * FPS))
+    return np.stack(frames), changes
+
+
+def run(source):
+    output = io.StringIO()
+    summary = replay(source, THRESHOLDS_PATH, fps=FPS, output=output)
+    return summary, [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_landmark_dump_replay_is_deterministic(tmp_path, facing):
+    landmarks, changes = make_dump(facing)
+    path = str(tmp_path / "session.npz")
+    np.savez(path, landmarks=landmarks, timestamps=np.arange(len(landmarks)) / FPS)
+
+    summary, decisions = run(path)
+    assert run(path)[1] == decisions
+    assert summary["frames"] == len(landmarks)
+
+    # One decision per change, alternating and shortly after it
+    assert [decision["message"] for decision in decisions] == ["play", "pause", "play", "pause", "play", "pause", "play"]
+    for decision, change in zip(decisions, changes):
+        assert change <= decision["time"] < change + 1.0
+        assert decision["frame"] == round(decision["time"] * FPS)
+
+
+def test_npy_and_npz_dumps_replay_alike(tmp_path, facing):
+    landmarks, _ = make_dump(facing)
+    np.save(str(tmp_path / "session.npy"), landmarks)
+    np.savez(str(tmp_path / "session.npz"), landmarks=landmarks)
+    assert run(str(tmp_path / "session.npy"))[1] == run(str(tmp_path / "session.npz"))[1]
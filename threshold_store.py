@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import threading
+from types import MappingProxyType
+from helpers import check_thresholds, get_threshold_array
+from typing import Dict, Mapping
+
+THRESHOLDS_FILE = 'attention_thresholds.json'
+
+####### THRESHOLD CACHE ########################################################################################################################################################
+
+def save_thresholds(thresholds: Dict[str, float], path: str = THRESHOLDS_FILE):
+    """
+    Write thresholds to disk atomically, so a running server polling the file
+    never sees a half written JSON document.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(thresholds, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class ThresholdStore:
+    """
+    Keeps the attention thresholds in memory as a read-only mapping.
+    The file is only re-parsed when its modification time changes, and the modification time
+    itself is checked at most once every check_interval seconds, so get() is cheap enough to
+    call on every frame. New values can also be pushed directly with update().
+    get_array() returns the same values in the layout used by helpers.get_direction_array.
+    Raises ValueError when the file cannot be loaded at construction; later a broken file keeps the
+    previous values.
+    """
+    def __init__(self, path: str = THRESHOLDS_FILE, check_interval: float = 0.5):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._thresholds = MappingProxyType({})
+        self._threshold_array = None
+        self._mtime = None
+        self._last_check = 0.0
+        if not self.reload():
+            raise ValueError(f"No usable thresholds in {path}, calibrate first or fix the file")
+
+    def get(self) -> Mapping[str, float]:
+        """Return the current thresholds, reloading the file first if it changed on disk"""
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self.reload()
+        return self._thresholds
+
+    def get_array(self):
+        """Return the current thresholds as a threshold array, reloading the file first if it changed on disk"""
+        self.get()
+        return self._threshold_array
+
+    def _set(self, thresholds: Dict[str, float]):
+        # Build both views before publishing, readers only ever see complete values
+        check_thresholds(thresholds)
+        threshold_array = get_threshold_array(thresholds)
+        threshold_array.flags.writeable = False
+        self._thresholds, self._threshold_array = MappingProxyType(dict(thresholds)), threshold_array
+
+    def reload(self, force: bool = False) -> bool:
+        """Re-read the thresholds file if its modification time changed. Returns True if new values were loaded"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if not force and mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.path) as f:
+                thresholds = json.load(f)
+            with self._lock:
+                self._set(thresholds)
+                self._mtime = mtime
+        except (OSError, ValueError, KeyError) as e:
+            # Keep the previous values; the file is read again only once it changes
+            self._mtime = mtime
+            print(f"Could not load thresholds from {self.path}: {e}")
+            return False
+        return True
+
+    def update(self, thresholds: Dict[str, float], save: bool = False):
+        """
+        Push new thresholds into the running server.
+        With save=True they are also written to the thresholds file.
+        """
+        with self._lock:
+            if save:
+                save_thresholds(thresholds, self.path)
+                try:
+                    self._mtime = os.stat(self.path).st_mtime_ns
+                except OSError:
+                    pass
+            self._set(thresholds)